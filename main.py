@@ -1,35 +1,100 @@
-import json
 import os
 import traceback
 
 import streamlit as st
 
-from src import utils
-from src.services.case_note_generation import CaseNotesGenerator
-from src.services.db_handler import BigQueryConnector
-from src.services.progress_notes_inference import ProgressNotes
+from src import clients, utils
+from src.services.db_handler import BigQueryConnector, progress_note_columns
+from src.services.job_queue import DONE, FAILED, get_job_queue
 from src.services.resource_recommendation import ResourceRecommender
 from src.services.sentiment_anaylsis import SentimentAnalysis
+from src.services.session_pipeline import SessionPipeline
 from src.services.speech_inference import SpeechToText
+from src.services.template_registry import get_template_registry
+from src.tracing import METRICS_PORT, span, start_metrics_server, trace_session
 
 st.set_page_config(page_title="Case Crafter",layout="wide")
 
 template_dict = {
-    "SOAP": "soap.json",
-    "DAP": "dap.json",
-    "BIRP": "birp.json"
+    "SOAP": "soap",
+    "DAP": "dap",
+    "BIRP": "birp"
 }
 
-utils.load_css('./src/css_styles/style.css')
 image_path = "logo.png"
 
-db_connector = BigQueryConnector()
+# send the transcript to the LLM once for all stages instead of once per stage
+COMBINED_INFERENCE = os.getenv("COMBINED_INFERENCE", "false").lower() == "true"
+# recognize WAV uploads with streaming_recognize instead of one long-running operation
+STREAMING_STT = os.getenv("STREAMING_STT", "false").lower() == "true"
+# render case-note sections as the model generates them
+STREAMING_CASE_NOTES = os.getenv("STREAMING_CASE_NOTES", "true").lower() == "true"
+# process sessions on the background job queue instead of in the script thread
+BACKGROUND_JOBS = os.getenv("BACKGROUND_JOBS", "true").lower() == "true"
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", 1.0))
+
+# (title, session_state key of the recommendation line, columns, [(label, checkbox key)])
+PROGRESS_PANELS = [
+    ("Client Presentation", "client_presentation", 3, [
+        ('Anxious', 'anxious'), ('Confused', 'confused'), ('Energetic', 'energetic'), ('Worried', 'worried'),
+        ('Fearful', 'fearful'), ('Cooperative', 'cooperative_1'), ('Withdrawn', 'withdrawn'),
+        ('Lethargic', 'lethargic'), ('Relaxed', 'relaxed'), ('Depressed', 'depressed')]),
+    ("Response To Treatment", "response_to_treatment", 2, [
+        ('Cooperative', 'cooperative_2'), ('Uninterested', 'uninterested'), ('Receptive', 'receptive'),
+        ('Combative', 'combative'), ('Engaged', 'engaged')]),
+    ("Client Status", "client_status", 2, [
+        ('Improving', 'improving'), ('Unchanged', 'unchanged'),
+        ('Regressed', 'regressed'), ('Deteriorating', 'deteriorating')]),
+    ("Risk Assessment", "risk_assessment", 2, [
+        ('Attempted to Cause Harm', 'attempted_harm'), ('Intention to Cause Harm', 'intention_harm'),
+        ('Suicidal Ideation', 'suicidal_ideation'), ('Danger to Self', 'danger_self'),
+        ('Danger to Other', 'danger_other'), ('Plan to Cause Harm', 'plan_harm')]),
+]
+
+
+@st.cache_resource
+def get_db_connector():
+    """One BigQueryConnector per process, shared by every session and rerun."""
+    return BigQueryConnector()
+
+
+@st.cache_resource
+def start_warm_up():
+    # create model and cloud clients once per process, off the render path
+    return clients.warm_up_in_background()
+
+
+if os.getenv("WARM_UP_CLIENTS", "true").lower() == "true":
+    start_warm_up()
+
+
+@st.cache_resource
+def start_metrics():
+    # one /metrics endpoint per process, not per session
+    return start_metrics_server(METRICS_PORT)
+
+
+if METRICS_PORT:
+    start_metrics()
+
+
+@st.cache_resource
+def start_job_queue():
+    # start the workers with the process, so queued and orphaned jobs resume without a visitor
+    return get_job_queue()
 
-session_id, therapist_id, client_id, client_name = utils.setup_session()
-if "session_id" not in st.session_state:
-    st.session_state["session_id"] = session_id
-else:
-    session_id = st.session_state["session_id"]
+
+if BACKGROUND_JOBS:
+    start_job_queue()
+
+utils.load_css('./src/css_styles/style.css')
+
+db_connector = get_db_connector()
+
+if "session" not in st.session_state:
+    st.session_state["session"] = utils.setup_session()
+session_id, therapist_id, client_id, client_name = st.session_state["session"]
+st.session_state["session_id"] = session_id
 
 if "page" not in st.session_state:
     st.session_state["page"] = "main"
@@ -43,10 +108,298 @@ if 'sentiment' not in st.session_state:
 if 'resource_links' not in st.session_state:
     st.session_state['resource_links'] = None
 
-def main_page():
+if 'progress_notes_db' not in st.session_state:
+    st.session_state['progress_notes_db'] = ("", "", "", "")
+
+# the job id stays in session state only: a URL carrying it would expose the job's notes to anyone it is shared with
+if 'job_id' not in st.session_state:
+    st.session_state['job_id'] = None
+
+
+@st.fragment
+def progress_notes_panel(title, state_key, n_columns, options):
+    """One group of progress-note checkboxes; a click reruns only this panel."""
+    st.markdown(f"###### {title}")
+    utils.initialize_session_state([key for _, key in options])
+    columns = st.columns(n_columns)
+    per_column, extra = divmod(len(options), n_columns)
+    start = 0
+    for i, column in enumerate(columns):
+        stop = start + per_column + (1 if i < extra else 0)
+        with column:
+            for label, key in options[start:stop]:
+                st.checkbox(label, key=key)
+        start = stop
+    st.markdown(st.session_state[state_key], unsafe_allow_html=True)
+
+
+def recommendation_html(items):
+    return '<p>Recommended: ' + ' '.join([f'<span class="recommendedtext">{item}</span>' for item in items]) + '</p>'
+
+
+def apply_results(result):
+    """Keep a finished session's outputs in session state for every panel to render."""
+    st.session_state['transcript'] = result['transcript']
+    st.session_state['content_text'] = [f"{value}" for value in result['case_notes'].values()]
+
+    if result.get('progress_notes') is not None:
+        progress_notes = result['progress_notes']['progress_notes'][0]
+        for _, state_key, _, _ in PROGRESS_PANELS:
+            st.session_state[state_key] = recommendation_html(progress_notes[state_key])
+        st.session_state['progress_notes_db'] = progress_note_columns(progress_notes)
+
+    st.session_state['sentiment'] = result.get('sentiment')
+    st.session_state['resource_links'] = result.get('resource_links')
+
+
+def submit_job(audio_file, user_template_option):
+    """Upload the recording and queue its processing; the page then polls the job."""
+    with st.spinner("Uploading audio..."):
+        audio_file_path = utils.upload_audio_to_gcs("therapy_audio", audio_file, session_id)
+    job_id = get_job_queue().submit({
+        "audio_uri": audio_file_path,
+        "template": template_dict[user_template_option],
+        "session_id": session_id,
+        "therapist_id": therapist_id,
+        "client_id": client_id,
+        "client_name": client_name,
+        "streaming_stt": STREAMING_STT,
+        "combined": COMBINED_INFERENCE,
+    }, owner=therapist_id)
+    print(f"Queued job {job_id}")
+    st.session_state['job_id'] = job_id
+    st.session_state['job_error'] = None
+
+
+def finish_job():
+    st.session_state['job_id'] = None
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def job_status_panel():
+    """Case notes of a running job, redrawn from its partial results on every poll."""
+    job = get_job_queue().get(st.session_state['job_id'])
+    if job is None or job['owner'] != therapist_id:
+        finish_job()
+        st.rerun(scope="app")
+
+    st.markdown("#### Case Notes")
+    # the job's own template, which the dropdown may no longer show
+    compiled_template = get_template_registry().get(job['payload']['template'])
+    section_lst = compiled_template.section_lst
+    case_notes = job['result'].get('case_notes') or {}
+    content_text = [f"{case_notes.get(section) or ''}" for section in section_lst]
+    st.markdown(utils.render_sections(section_lst, compiled_template.description_lst, content_text), unsafe_allow_html=True)
+    st.caption(f"Processing session: {job['stage']}...")
+
+    if job['status'] == DONE:
+        apply_results(job['result'])
+        finish_job()
+        st.rerun(scope="app")
+    elif job['status'] == FAILED:
+        st.session_state['job_error'] = job['error']
+        finish_job()
+        st.rerun(scope="app")
+
+
+def generate(audio_file, compiled_template, section_placeholder):
+    """Transcribe the recording, run the LLM stages and keep the results in session state."""
+    section_lst = compiled_template.section_lst
+    description_lst = compiled_template.description_lst
+
+    audio_file_path = utils.upload_audio_to_gcs("therapy_audio", audio_file, session_id)
+    speech_to_text = SpeechToText(audio_file_path, session_id=session_id)
+    transcript = speech_to_text.transcribe(streaming=STREAMING_STT)
+    print(transcript)
+    # TODO: speech to text
+    pipeline = SessionPipeline(transcript, compiled_template, combined=COMBINED_INFERENCE)
+    if STREAMING_CASE_NOTES:
+        def show_partial_notes(partial_notes):
+            st.session_state['content_text'] = [f"{partial_notes.get(section) or ''}" for section in section_lst]
+            section_placeholder.markdown(utils.render_sections(section_lst, description_lst, st.session_state['content_text']), unsafe_allow_html=True)
+
+        pipeline_result = pipeline.run_streaming(show_partial_notes)
+    else:
+        pipeline_result = pipeline.run()
+    case_notes = pipeline_result.case_notes
+    json_progress_notes = pipeline_result.progress_notes
+    print(case_notes)
+    if case_notes is None:
+        raise pipeline_result.case_notes_error()
+
+    db_connector.insert_case_notes(session_id, client_id, client_name, therapist_id, str(case_notes))
+
+    # sentiment and resources were produced by the same pipeline run
+    apply_results({
+        "transcript": transcript,
+        "case_notes": case_notes,
+        "progress_notes": json_progress_notes,
+        "sentiment": pipeline_result.sentiment,
+        "resource_links": pipeline_result.resource_links,
+    })
+    if pipeline_result.sentiment is not None:
+        db_connector.insert_progress_notes(session_id, client_id, client_name, therapist_id, *st.session_state['progress_notes_db'], pipeline_result.sentiment)
+
+
+@st.fragment
+def case_notes_panel(audio_file, user_template_option):
+    """Case notes, feedback and Generate; their widgets rerun only this panel."""
     try:
+        user_custom_feedback = None
+        save_button = False
+
+        # Output column
+        with st.container():
+            col_left, col_right= st.columns([8, 2])
+
+            with col_left:
+                st.markdown("#### Case Notes")
+
+            with col_right:
+                if st.button("📊 Dashboard"):
+                    st.session_state["page"] = "dashboard"
+                    st.rerun(scope="app")
+
+            compiled_template = get_template_registry().get(template_dict[user_template_option])
+            section_lst = compiled_template.section_lst
+            description_lst = compiled_template.description_lst
+
+            if len(st.session_state.get('content_text', [])) != len(section_lst):
+                st.session_state['content_text'] = [""] * len(section_lst)  # Empty content initially for all sections
+
+            # Placeholder for bordered section
+            section_placeholder = st.empty()
+            section_placeholder.markdown(utils.render_sections(section_lst, description_lst, st.session_state['content_text']), unsafe_allow_html=True)
+            if st.session_state.get('job_error'):
+                st.error(f"Processing failed: {st.session_state['job_error']}")
+
+        if 'disliked' not in st.session_state:
+            st.session_state['disliked'] = False
+        col1, col2, col3, col4 = st.columns([1, 1, 4, 1.5])
+
+        with col1:
+            st.markdown(
+                """
+                <style>
+                .stButton button {
+                    margin-left: 0;
+                }
+                </style>
+                """,
+                unsafe_allow_html=True
+            )
+            if st.button(":thumbsup:"):
+                st.session_state['disliked'] = False
+                st.write("Thank you!")
+                print("I have been liked")
+
+        with col2:
+            st.markdown(
+                """
+                <style>
+                .stButton button {
+                    margin-left: 0;
+                }
+                </style>
+                """,
+                unsafe_allow_html=True
+            )
+            if st.button(":thumbsdown:"):
+                print("I have been disliked")
+                st.session_state['disliked'] = True
+
+        if st.session_state['disliked']:
+            feedback_options = ['Too Long', 'Not accurate', 'Poor tone or style', 'Biased or inappropriate', 'Confusing or Unclear', 'Other']
+            user_feedback = st.selectbox("Please tell us why you disliked it:", feedback_options)
+
+            if user_feedback:
+                st.write(f"You selected: {user_feedback}")
+
+            if user_feedback == 'Other':
+                text_col1, save_col2 = st.columns([4, 1])
+
+                with text_col1:
+                    user_custom_feedback = st.text_input("Please provide more details")
+
+                # Save button
+                with save_col2:
+                    st.write("")
+                    save_button = st.button("💾 Save")
+
+        with col4:
+            st.markdown(
+                    """
+                    <style>
+                    .stButton button {
+                        float: right;
+                        width: 100%;  /* Take full width */
+                        white-space: nowrap;  /* Prevent breaking */
+                        padding: 10px;  /* Add padding for spacing */
+                        overflow: hidden;  /* Ensure no text overflows */
+                        text-overflow: ellipsis;  /* Add ellipsis if text is too long */
+                        font-size: 16px;  /* Adjust font size */
+                    }
+                    </style>
+                    """,
+                    unsafe_allow_html=True
+                )
+            if st.button("⚡ Generate"):
+
+                print("Generate clicked")
+                if audio_file is not None and BACKGROUND_JOBS:
+                    submit_job(audio_file, user_template_option)
+                    st.rerun(scope="app")
+                with st.spinner("Loading Data..."):
+                    if audio_file is not None:
+                        with trace_session(session_id), span("session", source="ui"):
+                            generate(audio_file, compiled_template, section_placeholder)
+                        # redraw the progress notes, sentiment and resources with the new results
+                        st.rerun(scope="app")
+
+        if user_custom_feedback:
+            if save_button:
+                db_connector.insert_feedback(session_id, user_custom_feedback)
+                selected = [utils.get_selected_keys_string([key for _, key in options])
+                            for _, _, _, options in PROGRESS_PANELS]
+                db_connector.insert_progress_notes(session_id, client_id, client_name, therapist_id, *selected, st.session_state['sentiment'])
+                st.write("Thank you for your feedback!")
 
-        user_custom_feedback= None
+    except Exception as e:
+        print(traceback.format_exc())
+        st.error(f"Something went wrong: {e}")
+
+
+@st.fragment
+def sentiment_panel():
+    st.markdown("##### Sentiment Analysis")
+    if st.session_state["transcript"] != None:
+        if st.session_state["sentiment"] != None:
+            st.markdown(f"Sentiment Emotion Detected: {st.session_state['sentiment']}") 
+        else:
+            sentiment_class = SentimentAnalysis(st.session_state['transcript'])
+            sentiment = sentiment_class.run_sentiment()
+            st.session_state['sentiment'] = sentiment
+            st.markdown(f"Sentiment Emotion Detected: {sentiment}")
+            db_connector.insert_progress_notes(session_id, client_id, client_name, therapist_id, *st.session_state['progress_notes_db'], sentiment)
+
+
+@st.fragment
+def resources_panel():
+    st.markdown("##### Suggested Resources")
+    if st.session_state["transcript"] != None:
+        if st.session_state['resource_links'] != None:
+            for item in st.session_state['resource_links']:
+                st.markdown(f"- {item}")
+        else:
+            recommender = ResourceRecommender(st.session_state['transcript'])
+            resource_links = recommender.get_recommendations()
+            st.session_state['resource_links'] = resource_links
+            for item in resource_links:
+                st.markdown(f"- {item}")
+
+
+def main_page():
+    try:
 
         # columns for layout
         logo_col, title_col = st.columns([0.01, 6])
@@ -76,21 +429,14 @@ def main_page():
         left_col, right_col = st.columns([4, 6])
 
         # Initialize session state for recommendation text
-        if 'client_presentation' not in st.session_state:
-            st.session_state['client_presentation'] = '<p>Recommended: </p>'
-        if 'response_to_treatment' not in st.session_state:
-            st.session_state['response_to_treatment'] = '<p>Recommended: </p>'
-        if 'client_status' not in st.session_state:
-            st.session_state['client_status'] = '<p>Recommended: </p>'
-        if 'risk_assessment' not in st.session_state:
-            st.session_state['risk_assessment'] = '<p>Recommended: </p>'
+        for _, state_key, _, _ in PROGRESS_PANELS:
+            if state_key not in st.session_state:
+                st.session_state[state_key] = '<p>Recommended: </p>'
 
         with left_col:
             st.markdown('')
             st.markdown("##### Upload Audio")
             audio_file = st.file_uploader("Upload Audio", type=["mp3", "mp4", "wav", "m4a"])
-            if audio_file:
-                utils.save_audio_file(audio_file.read(), "mp3")
 
             st.markdown("##### Template Style")
             user_template_option = st.selectbox('Select your preferred template style',('SOAP', 'DAP', 'BIRP'))
@@ -98,281 +444,22 @@ def main_page():
 
             st.markdown("#### Progress Notes")
 
-            st.markdown("###### Client Presentation")
-
-            section1_keys = ['anxious', 'confused', 'energetic', 'worried', 'fearful','cooperative_1','withdrawn','lethargic','relaxed','depressed']
-            section2_keys = ['cooperative_2', 'uninterested', 'receptive', 'combative', 'engaged']
-            section3_keys = ['improving', 'unchanged', 'regressed', 'deteriorating']
-            section4_keys = ['attempted_harm', 'intention_harm', 'suicidal_ideation', 'danger_self', 'danger_other', 'plan_harm']
-
-            utils.initialize_session_state(section1_keys)
-            utils.initialize_session_state(section2_keys)
-            utils.initialize_session_state(section3_keys)
-            utils.initialize_session_state(section4_keys)
-
-            section_1 = st.columns(3)
-            with section_1[0]:
-                option_1 = st.checkbox('Anxious', key="anxious")
-                option_2 = st.checkbox('Confused', key="confused")
-                option_3 = st.checkbox('Energetic', key='energetic')
-                option_4 = st.checkbox('Worried',key='worried')
-            with section_1[1]:
-                option_5 = st.checkbox('Fearful',key='fearful')
-                option_6 = st.checkbox('Cooperative', key="cooperative_1")
-                option_7 = st.checkbox('Withdrawn',key='withdrawn')
-            with section_1[2]:
-                option_8 = st.checkbox('Lethargic',key='lethargic')
-                option_9 = st.checkbox('Relaxed',key='relaxed')
-                option_10 = st.checkbox('Depressed',key='depressed')
-
-            recommendation_1_placeholder = st.empty()
-            recommendation_1_placeholder.markdown(st.session_state['client_presentation'], unsafe_allow_html=True)
-
-            st.markdown("###### Response To Treatment")
-            section_2 = st.columns(2)
-            with section_2[0]:
-                option_11 = st.checkbox('Cooperative', key="cooperative_2")
-                option_12 = st.checkbox('Uninterested', key='uninterested')
-                option_13 = st.checkbox('Receptive',key='receptive')
-            with section_2[1]:
-                option_14 = st.checkbox('Combative',key='combative')
-                option_15 = st.checkbox('Engaged',key='engaged')
-
-            recommendation_2_placeholder = st.empty()
-            recommendation_2_placeholder.markdown(st.session_state['response_to_treatment'], unsafe_allow_html=True)
-
-            st.markdown("###### Client Status")
-            section_3 = st.columns(2)
-            with section_3[0]:
-                option_16 = st.checkbox('Improving', key="improving")
-                option_17 = st.checkbox('Unchanged', key="unchanged")
-            with section_3[1]:
-                option_18 = st.checkbox('Regressed', key="regressed")
-                option_19 = st.checkbox('Deteriorating', key='deteriorating')
-
-            recommendation_3_placeholder = st.empty()
-            recommendation_3_placeholder.markdown(st.session_state['client_status'], unsafe_allow_html=True)
-
-            st.markdown("###### Risk Assessment")
-            section_4 = st.columns(2)
-            with section_4[0]:
-                option_20 = st.checkbox('Attempted to Cause Harm', key="attempted_harm")
-                option_21 = st.checkbox('Intention to Cause Harm', key="intention_harm")
-                option_22 = st.checkbox('Suicidal Ideation', key="suicidal_ideation")
-            with section_4[1]:
-                option_23 = st.checkbox('Danger to Self', key="danger_self")
-                option_24 = st.checkbox('Danger to Other', key="danger_other")
-                option_25 = st.checkbox('Plan to Cause Harm', key="plan_harm")
-
-            recommendation_4_placeholder = st.empty()
-            recommendation_4_placeholder.markdown(st.session_state['risk_assessment'], unsafe_allow_html=True)
+            for title, state_key, n_columns, options in PROGRESS_PANELS:
+                progress_notes_panel(title, state_key, n_columns, options)
 
         with right_col:
-            # Output column
-            with st.container():
-                section_lst = []
-                description_lst = []
-                content_lst= []
-
-                col_left, col_right= st.columns([8, 2])
-
-                with col_left:
-                    st.markdown("#### Case Notes")
-
-                with col_right:
-                    if st.button("📊 Dashboard"):
-                        st.session_state["page"] = "dashboard"
-                        st.rerun()
-
-                if user_template_option in template_dict:
-                    json_template_file = template_dict[user_template_option]
-                json_file = "./src/dependencies/{}".format(json_template_file)
-                with open(json_file, 'r') as file:
-                    data = json.load(file)
-                    for section, details in data['sections'].items():
-                        section_lst.append(section)
-                        description_lst.append(details['description'])
-                        content_lst.append(details["content"])
-                placeholders = {}
-
-                if 'content_text' not in st.session_state:
-                    st.session_state['content_text'] = [""] * len(section_lst)  # Empty content initially for all sections
-
-                # Placeholder for bordered section
-                section_placeholder = st.empty()
-                section_placeholder.markdown(utils.render_sections(section_lst, description_lst, st.session_state['content_text']), unsafe_allow_html=True)
-
-            if 'disliked' not in st.session_state:
-                st.session_state['disliked'] = False
-            col1, col2, col3, col4 = st.columns([1, 1, 4, 1.5])
-
-            with col1:
-                st.markdown(
-                    """
-                    <style>
-                    .stButton button {
-                        margin-left: 0;
-                    }
-                    </style>
-                    """,
-                    unsafe_allow_html=True
-                )
-                if st.button(":thumbsup:"):
-                    st.session_state['disliked'] = False
-                    st.write("Thank you!")
-                    print("I have been liked")
-
-            with col2:
-                st.markdown(
-                    """
-                    <style>
-                    .stButton button {
-                        margin-left: 0;
-                    }
-                    </style>
-                    """,
-                    unsafe_allow_html=True
-                )
-                if st.button(":thumbsdown:"):
-                    print("I have been disliked")
-                    st.session_state['disliked'] = True
-
-            if st.session_state['disliked']:
-                feedback_options = ['Too Long', 'Not accurate', 'Poor tone or style', 'Biased or inappropriate', 'Confusing or Unclear', 'Other']
-                user_feedback = st.selectbox("Please tell us why you disliked it:", feedback_options)
-
-                if user_feedback:
-                    st.write(f"You selected: {user_feedback}")
-
-                if user_feedback == 'Other':
-                    text_col1, save_col2 = st.columns([4, 1])
-
-                    with text_col1:
-                        user_custom_feedback = st.text_input("Please provide more details")
-
-                    # Save button
-                    with save_col2:
-                        st.write("")
-                        save_button = st.button("💾 Save")
-
-            with col4:
-                st.markdown(
-                        """
-                        <style>
-                        .stButton button {
-                            float: right;
-                            width: 100%;  /* Take full width */
-                            white-space: nowrap;  /* Prevent breaking */
-                            padding: 10px;  /* Add padding for spacing */
-                            overflow: hidden;  /* Ensure no text overflows */
-                            text-overflow: ellipsis;  /* Add ellipsis if text is too long */
-                            font-size: 16px;  /* Adjust font size */
-                        }
-                        </style>
-                        """,
-                        unsafe_allow_html=True
-                    )
-                if st.button("⚡ Generate"):
-
-                    print("Generate clicked")
-                    with st.spinner("Loading Data..."):
-                        if audio_file is not None:
-                            audio_file = max(
-                                [f for f in os.listdir(".") if f.startswith("audio")],
-                                key=os.path.getctime,
-                            )
-                            audio_file_path = utils.upload_to_gcs("therapy_audio", audio_file, f"audio_files/{audio_file}")
-                            speech_to_text = SpeechToText(audio_file_path)
-                            transcribe_file_path = speech_to_text.transcribe_speech()
-
-                            transcript = utils.read_text_file_from_gcs(transcribe_file_path)
-                            st.session_state['transcript'] = transcript
-                            print(transcript)
-                            # TODO: speech to text
-                            user_template_option = user_template_option.lower()
-                            notes_template = utils.load_template(f"./src/dependencies/{user_template_option}")
-                            notes_generator = CaseNotesGenerator(transcript, notes_template)
-                            case_notes = notes_generator.get_notes()
-                            print(case_notes)
-
-                            db_connector.insert_case_notes(session_id, client_id, client_name, therapist_id, str(case_notes))
-
-                            # get progress notes output from model
-                            progress_notes = ProgressNotes(transcript)
-                            json_progress_notes = progress_notes.run_progress_notes()
-
-                            # update case notes in ui
-                            content_lst = []
-                            for key, value in case_notes.items():
-                                content_lst.append(value)
-                            for i in range(len(content_lst)):
-                                st.session_state['content_text'][i] = f"{content_lst[i]}"
-                            section_placeholder.markdown(utils.render_sections(section_lst, description_lst, st.session_state['content_text']), unsafe_allow_html=True)
-
-                            # update progress notes
-                            client_presentation = json_progress_notes['progress_notes'][0]['client_presentation']
-                            response_to_treatment = json_progress_notes['progress_notes'][0]['response_to_treatment']
-                            client_status = json_progress_notes['progress_notes'][0]['client_status']
-                            risk_assessment = json_progress_notes['progress_notes'][0]['risk_assessment']
-
-                            client_presentation_db = ', '.join([item.lower() for item in client_presentation])
-                            response_to_treatment_db = ', '.join([item.lower() for item in response_to_treatment])
-                            client_status_db = ', '.join([item.lower() for item in client_status])
-                            risk_assessment_db = ', '.join([item.lower() for item in risk_assessment])
-
-                            client_presentation_html = '<p>Recommended: ' + ' '.join([f'<span class="recommendedtext">{item}</span>' for item in client_presentation]) + '</p>'
-                            response_to_treatment_html = '<p>Recommended: ' + ' '.join([f'<span class="recommendedtext">{item}</span>' for item in response_to_treatment]) + '</p>'
-                            client_status_html = '<p>Recommended: ' + ' '.join([f'<span class="recommendedtext">{item}</span>' for item in client_status]) + '</p>'
-                            risk_assessment_html = '<p>Recommended: ' + ' '.join([f'<span class="recommendedtext">{item}</span>' for item in risk_assessment]) + '</p>'
-
-                            # Update session state
-                            st.session_state['client_presentation'] = client_presentation_html
-                            st.session_state['response_to_treatment'] = response_to_treatment_html
-                            st.session_state['client_status'] = client_status_html
-                            st.session_state['risk_assessment'] = risk_assessment_html
-
-                            # Update the placeholders with the new recommendations using HTML
-                            utils.update_recommendations(recommendation_1_placeholder, client_presentation, "Recommended")
-                            utils.update_recommendations(recommendation_2_placeholder, response_to_treatment, "Recommended")
-                            utils.update_recommendations(recommendation_3_placeholder, client_status, "Recommended")
-                            utils.update_recommendations(recommendation_4_placeholder, risk_assessment, "Recommended")
-
-                if user_custom_feedback:
-                    if save_button:
-                        db_connector.insert_feedback(session_id, user_custom_feedback)
-                        client_presentation_final = utils.get_selected_keys_string(section1_keys)
-                        response_treatment_final = utils.get_selected_keys_string(section2_keys)
-                        client_status_final = utils.get_selected_keys_string(section3_keys)
-                        risk_assesment_final = utils.get_selected_keys_string(section4_keys)
-                        db_connector.insert_progress_notes(session_id, therapist_id, client_name, client_id, client_presentation_final, response_treatment_final, client_status_final, risk_assesment_final, st.session_state['sentiment'])
-                        st.write("Thank you for your feedback!")
+            if st.session_state['job_id']:
+                job_status_panel()
+            else:
+                case_notes_panel(audio_file, user_template_option)
 
             st.markdown("-------")
-            st.markdown("##### Sentiment Analysis")
-            if st.session_state["transcript"] != None:
-                if st.session_state["sentiment"] != None:
-                    st.markdown(f"Sentiment Emotion Detected: {st.session_state['sentiment']}") 
-                else:
-                    sentiment_class = SentimentAnalysis(transcript)
-                    sentiment = sentiment_class.run_sentiment()
-                    st.session_state['sentiment'] = sentiment
-                    st.markdown(f"Sentiment Emotion Detected: {sentiment}")
-                    db_connector.insert_progress_notes(session_id, therapist_id, client_name, client_id, client_presentation_db, response_to_treatment_db, client_status_db, risk_assessment_db, sentiment)
-
-            st.markdown("##### Suggested Resources")
-            if st.session_state["transcript"] != None:
-                if st.session_state['resource_links'] != None:
-                    for item in st.session_state['resource_links']:
-                        st.markdown(f"- {item}")
-                else:
-                    recommender = ResourceRecommender(transcript)
-                    resource_links = recommender.get_recommendations()
-                    st.session_state['resource_links'] = resource_links
-                    for item in resource_links:
-                        st.markdown(f"- {item}")
+            sentiment_panel()
+            resources_panel()
 
     except Exception as e:
         print(traceback.format_exc())
+        st.error(f"Something went wrong: {e}")
 
 def dashboard_page():
     logo_col, title_col = st.columns([0.01, 6])
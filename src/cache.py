@@ -0,0 +1,214 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+from src.tracing import span
+
+load_dotenv()
+
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+# cached values are clinical notes in plaintext, so they only go to disk when asked for
+CACHE_DISK_ENABLED = os.getenv("CACHE_DISK_ENABLED", "false").lower() == "true"
+CACHE_PATH = os.getenv("CACHE_PATH", ".cache/results.sqlite3")
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", 7 * 24 * 3600))
+CACHE_MEMORY_ENTRIES = int(os.getenv("CACHE_MEMORY_ENTRIES", 256))
+CACHE_DISK_BYTES = int(os.getenv("CACHE_DISK_BYTES", 256 * 1024 * 1024))
+
+
+def make_key(stage, transcript, template=None, prompt_version=None,
+             model_name=None, generation_config=None):
+    """Content-addressed key for one LLM stage.
+
+    Any change to the inputs, prompt version, model or generation config
+    produces a different key, so stale entries are never served. Prompts
+    are not part of the key, so every cached stage module defines a
+    ``PROMPT_VERSION`` that must be bumped whenever its prompts change.
+    """
+    payload = json.dumps({
+        "stage": stage,
+        "transcript": transcript,
+        "template": template,
+        "prompt_version": prompt_version,
+        "model_name": model_name,
+        "generation_config": generation_config,
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Two-tier cache of JSON-serialisable results: in-process LRU over SQLite."""
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL_SECONDS,
+                 memory_entries=CACHE_MEMORY_ENTRIES, disk_bytes=CACHE_DISK_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.disk_bytes = disk_bytes
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        if self.path:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with self._connect() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS results ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                    "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+                )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _remember(self, key, serialized, created_at):
+        # values are kept serialised so callers can never mutate a cached entry
+        with self._lock:
+            self._memory[key] = (serialized, created_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss or expiry."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                serialized, created_at = entry
+                if now - created_at <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return json.loads(serialized)
+                del self._memory[key]
+
+        if self.path:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT value, created_at FROM results WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] <= self.ttl:
+                    conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+                    value = json.loads(row[0])
+                    self._remember(key, row[0], row[1])
+                    with self._lock:
+                        self.stats["disk_hits"] += 1
+                    return value
+                if row is not None:
+                    conn.execute("DELETE FROM results WHERE key = ?", (key,))
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def set(self, key, value):
+        now = time.time()
+        serialized = json.dumps(value)
+        self._remember(key, serialized, now)
+        if not self.path:
+            return
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, serialized, len(serialized), now, now),
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        """Drop expired rows, then least recently used rows above the size budget."""
+        conn.execute("DELETE FROM results WHERE created_at < ?", (now - self.ttl,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.disk_bytes:
+            return
+        for key, size in conn.execute(
+                "SELECT key, size FROM results ORDER BY accessed_at").fetchall():
+            if total <= self.disk_bytes:
+                break
+            conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            total -= size
+
+    def get_or_compute(self, key, compute):
+        """Return the cached value for key, computing and storing it on a miss."""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self.path:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM results")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Process-wide ResultCache; memory-only unless CACHE_DISK_ENABLED, or if the disk tier cannot be opened."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                try:
+                    _cache = ResultCache(path=CACHE_PATH if CACHE_DISK_ENABLED else None)
+                except (OSError, sqlite3.Error) as e:
+                    print(f"Disk cache unavailable, using memory only: {e}")
+                    _cache = ResultCache(path=None)
+    return _cache
+
+
+def cached(stage, transcript, compute, **key_parts):
+    """Run compute() through the result cache unless caching is disabled, in an llm.<stage> span."""
+    with span(f"llm.{stage}", transcript_chars=len(transcript)) as current:
+        if not CACHE_ENABLED:
+            return compute()
+        computed = []
+
+        def compute_and_flag():
+            computed.append(True)
+            return compute()
+
+        key = make_key(stage, transcript, **key_parts)
+        value = get_result_cache().get_or_compute(key, compute_and_flag)
+        current.set(cache_hit=not computed)
+        return value
+
+
+def cached_stream(stage, transcript, stream, **key_parts):
+    """Yield the partial values of stream(), storing the final one in the result cache.
+
+    On a hit the cached value is yielded once and stream() is never called.
+    Like cached(), the work is recorded in an llm.<stage> span.
+    """
+    with span(f"llm.{stage}", transcript_chars=len(transcript)) as current:
+        if not CACHE_ENABLED:
+            yield from stream()
+            return
+        key = make_key(stage, transcript, **key_parts)
+        cache = get_result_cache()
+        value = cache.get(key)
+        current.set(cache_hit=value is not None)
+        if value is not None:
+            yield value
+            return
+        for value in stream():
+            yield value
+        if value is not None:
+            cache.set(key, value)
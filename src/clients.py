@@ -0,0 +1,162 @@
+import os
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# The Google Cloud, Vertex AI and LangChain integration packages take seconds
+# to import, so they are imported inside the factories below on first use.
+
+PROJECT_ID = os.getenv("PROJECT_ID", "lithe-sandbox-444313-n8")
+REGION = os.getenv("REGION", "asia-southeast1")
+CHAT_MODEL_NAME = "gemini-1.5-pro"
+EMBEDDING_MODEL_NAME = "text-embedding-005"
+# serve repeated document and query embeddings from the local embedding store
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+SENTIMENT_ENDPOINT = "projects/738905644646/locations/asia-southeast1/endpoints/6471483548531425280"
+
+# Process-wide registry, shared by every Streamlit session and worker thread.
+_clients = {}
+# re-entrant, as some factories build on other registry clients
+_lock = threading.RLock()
+_warmed_up = threading.Event()
+
+
+def _get_or_create(key, factory):
+    """Return the client stored under key, creating it once per process."""
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = factory()
+                _clients[key] = client
+    return client
+
+
+def init_vertexai(project=PROJECT_ID, location=REGION):
+    """Initialise the Vertex AI SDK once per process, before the first model is created."""
+    def create():
+        import vertexai
+
+        vertexai.init(project=project, location=location)
+        return True
+
+    return _get_or_create(("vertexai", project, location), create)
+
+
+def get_chat_model(model_name=CHAT_MODEL_NAME):
+    def create():
+        from langchain_google_vertexai import (ChatVertexAI, HarmBlockThreshold,
+                                               HarmCategory)
+
+        from src.tracing import usage_callback
+
+        init_vertexai()
+        return ChatVertexAI(
+            model_name=model_name,
+            convert_system_message_to_human=True,
+            # retries on quota errors are handled by src.rate_limit, which also adapts concurrency
+            max_retries=1,
+            callbacks=[usage_callback()],
+            safety_settings={
+                HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_LOW_AND_ABOVE
+            },
+        )
+
+    return _get_or_create(("chat", model_name), create)
+
+
+def get_generative_model(model_name=SENTIMENT_ENDPOINT, system_instruction="You are a model able to classify a text"):
+    def create():
+        from vertexai.generative_models import GenerativeModel
+
+        init_vertexai()
+        return GenerativeModel(model_name, system_instruction=[system_instruction])
+
+    return _get_or_create(("generative", model_name, system_instruction), create)
+
+
+def get_embeddings(model_name=EMBEDDING_MODEL_NAME):
+    def create():
+        from langchain_google_vertexai import VertexAIEmbeddings
+
+        from src.deployment.embedding_store import CachedEmbeddings
+
+        init_vertexai()
+        embeddings = VertexAIEmbeddings(model_name=model_name)
+        if EMBEDDING_CACHE_ENABLED:
+            return CachedEmbeddings(embeddings, model_name)
+        return embeddings
+
+    return _get_or_create(("embeddings", model_name), create)
+
+
+def get_vector_search(index_id=None, endpoint_id=None):
+    from src.deployment.vector_search import VectorSearch
+
+    index_id = index_id or os.getenv("INDEX_ID")
+    endpoint_id = endpoint_id or os.getenv("ENDPOINT_ID")
+    return _get_or_create(("vector_search", index_id, endpoint_id), lambda: VectorSearch(
+        index_id=index_id,
+        endpoint_id=endpoint_id,
+        embedding_model=get_embeddings(),
+    ))
+
+
+def get_storage_client():
+    def create():
+        from google.cloud import storage
+
+        return storage.Client()
+
+    return _get_or_create(("storage",), create)
+
+
+def get_bigquery_client():
+    def create():
+        from google.cloud import bigquery
+
+        return bigquery.Client()
+
+    return _get_or_create(("bigquery",), create)
+
+
+def get_speech_client():
+    from google.cloud import speech
+
+    credentials_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
+    if credentials_path:
+        return _get_or_create(("speech", credentials_path),
+                              lambda: speech.SpeechClient.from_service_account_file(credentials_path))
+    return _get_or_create(("speech", None), speech.SpeechClient)
+
+
+def warm_up(include_vector_search=True):
+    """Create every shared client up front so the first request reuses them.
+
+    Safe to call more than once; only the first call does any work. Failures
+    are printed rather than raised so a missing service does not block start-up.
+    """
+    if _warmed_up.is_set():
+        return
+    _warmed_up.set()
+
+    factories = [get_chat_model, get_generative_model, get_embeddings,
+                 get_storage_client, get_bigquery_client, get_speech_client]
+    if include_vector_search:
+        factories.append(get_vector_search)
+
+    for factory in factories:
+        try:
+            factory()
+        except Exception as e:
+            print(f"Warm-up of {factory.__name__} failed: {e}")
+    print("Clients warmed up.")
+
+
+def warm_up_in_background(include_vector_search=True):
+    thread = threading.Thread(target=warm_up, args=(include_vector_search,), daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,158 @@
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from contextlib import contextmanager
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+# modules main.py pulls in while rendering the first page
+APP_MODULES = [
+    "src.utils",
+    "src.services.db_handler",
+    "src.services.session_pipeline",
+    "src.services.speech_inference",
+    "src.services.template_registry",
+]
+# packages that should only be imported on first use, not at start-up
+HEAVY_PACKAGES = ["langchain_google_vertexai", "vertexai", "google.cloud.aiplatform",
+                  "google.cloud.speech", "google.cloud.bigquery", "google.cloud.storage"]
+
+
+def measure_importtime(modules, root=REPO_ROOT):
+    """Import modules in a fresh interpreter with -X importtime.
+
+    Returns (wall seconds, {package: cumulative seconds}) from the
+    interpreter's own import log.
+    """
+    code = "; ".join(f"import {module}" for module in modules)
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                               cwd=root, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+
+    cumulative = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, microseconds, name = line[len("import time:"):].split("|")
+        cumulative[name.strip()] = int(microseconds) / 1e6
+    return wall, cumulative
+
+
+def time_to_first_render(script="main.py", timeout=120, root=REPO_ROOT):
+    """Seconds from interpreter start until the first script run of the app completes."""
+    code = ("from streamlit.testing.v1 import AppTest; "
+            f"AppTest.from_file({script!r}, default_timeout={timeout}).run()")
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-c", code], cwd=root,
+                               capture_output=True, text=True, timeout=timeout)
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+    return time.perf_counter() - start
+
+
+def time_to_healthy(script="main.py", timeout=120, root=REPO_ROOT):
+    """Seconds from `streamlit run` until the server answers its health check."""
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        port = s.getsockname()[1]
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", script, "--server.headless=true",
+         f"--server.port={port}"],
+        cwd=root, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f"http://localhost:{port}/_stcore/health", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.05)
+        raise TimeoutError(f"Streamlit did not become healthy within {timeout}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+@contextmanager
+def checkout(ref):
+    """Check ref out into a temporary git worktree and yield its path."""
+    path = tempfile.mkdtemp(prefix="cold-start-")
+    subprocess.run(["git", "worktree", "add", "--detach", path, ref], cwd=REPO_ROOT,
+                   check=True, capture_output=True)
+    try:
+        yield path
+    finally:
+        subprocess.run(["git", "worktree", "remove", "--force", path], cwd=REPO_ROOT, capture_output=True)
+
+
+def app_modules(root):
+    # older trees do not have every module yet
+    return [module for module in APP_MODULES
+            if os.path.exists(os.path.join(root, *module.split(".")) + ".py")]
+
+
+def measure(root, runs, skip_server):
+    """Samples of every start-up measurement for the tree at root, plus the last import log."""
+    samples = {"import app modules": []}
+    for _ in range(runs):
+        wall, cumulative = measure_importtime(app_modules(root), root)
+        samples["import app modules"].append(wall)
+    samples["time to first render"] = [time_to_first_render(root=root) for _ in range(runs)]
+    if not skip_server:
+        samples["time to healthy server"] = [time_to_healthy(root=root) for _ in range(runs)]
+    return samples, cumulative
+
+
+def report(label, samples):
+    print(f"{label}: median {statistics.median(samples):.2f}s, "
+          f"min {min(samples):.2f}s, max {max(samples):.2f}s over {len(samples)} runs")
+
+
+def report_imports(cumulative, top):
+    print("Slowest imports (cumulative, last run):")
+    top_level = {name: seconds for name, seconds in cumulative.items() if "." not in name}
+    for name, seconds in sorted(top_level.items(), key=lambda item: -item[1])[:top]:
+        print(f"  {seconds * 1000:8.1f} ms  {name}")
+    eager = [package for package in HEAVY_PACKAGES if package in cumulative]
+    print(f"Heavy packages imported at start-up: {', '.join(eager) or 'none'}")
+
+
+if __name__ == "__main__":
+    # python -m src.deployment.cold_start --compare <commit before the change>
+    parser = argparse.ArgumentParser(description="Measure the cold start of the Streamlit app.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="slowest imports to list")
+    parser.add_argument("--skip-server", action="store_true",
+                        help="only measure imports and the first script run")
+    parser.add_argument("--compare", metavar="REF",
+                        help="also measure git REF in a temporary worktree and print before/after")
+    args = parser.parse_args()
+
+    after, cumulative = measure(REPO_ROOT, args.runs, args.skip_server)
+    if args.compare:
+        with checkout(args.compare) as baseline_root:
+            before, baseline_cumulative = measure(baseline_root, args.runs, args.skip_server)
+        print(f"== {args.compare}")
+        for label, samples in before.items():
+            report(label, samples)
+        report_imports(baseline_cumulative, args.top)
+        print("== working tree")
+
+    for label, samples in after.items():
+        report(label, samples)
+    report_imports(cumulative, args.top)
+
+    if args.compare:
+        print("== change in median")
+        for label, samples in after.items():
+            old, new = statistics.median(before[label]), statistics.median(samples)
+            print(f"{label}: {old:.2f}s -> {new:.2f}s ({(new - old) / old * 100:+.0f}%)")
@@ -0,0 +1,159 @@
+import fcntl
+import hashlib
+import os
+import threading
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+
+from src.rate_limit import get_limiter
+from src.tracing import span
+
+load_dotenv()
+
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", ".cache/embeddings")
+# matches DIMENSIONS in deploy_index.py for text-embedding-005
+EMBEDDING_DIMENSIONS = 768
+
+
+def embedding_key(model_name, task, text):
+    return hashlib.sha256(f"{model_name}\0{task}\0{text}".encode("utf-8")).hexdigest()
+
+
+def embed_queries(embeddings, texts):
+    """Embed queries in one batch request when the model supports it."""
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(texts)
+    if hasattr(embeddings, "embed"):
+        # VertexAIEmbeddings: batch call with the query task type
+        return get_limiter("embeddings").call(
+            lambda: embeddings.embed(texts, embeddings_task_type="RETRIEVAL_QUERY"))
+    return [get_limiter("embeddings").call(lambda: embeddings.embed_query(text)) for text in texts]
+
+
+class EmbeddingStore:
+    """Append-only store of float32 vectors keyed by content hash.
+
+    Vectors live in ``vectors.f32`` as consecutive rows and are read through
+    a read-only memory map, so lookups return views without copying. The hash
+    index is an append-only ``keys.log`` of ``<key> <row>`` lines, replayed on
+    open. Vectors are written before their keys, so a torn write is ignored on
+    the next load, and a partial row left by a crashed writer is truncated
+    before the next append. Appends take an exclusive file lock, so several
+    processes can share one directory.
+    """
+
+    def __init__(self, directory=EMBEDDING_CACHE_DIR, dimensions=EMBEDDING_DIMENSIONS):
+        self.dimensions = dimensions
+        self.row_bytes = dimensions * np.dtype(np.float32).itemsize
+        os.makedirs(directory, exist_ok=True)
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.keys_path = os.path.join(directory, "keys.log")
+        self._index = {}
+        self._mmap = None
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        rows = os.path.getsize(self.vectors_path) // self.row_bytes if os.path.exists(self.vectors_path) else 0
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) == 2 and int(parts[1]) < rows:
+                        self._index[parts[0]] = int(parts[1])
+        self._rows = rows
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def _view(self):
+        if self._mmap is None or len(self._mmap) < self._rows:
+            self._mmap = np.memmap(self.vectors_path, dtype=np.float32, mode="r",
+                                   shape=(self._rows, self.dimensions))
+        return self._mmap
+
+    def get(self, key):
+        """Return the stored vector as a read-only view, or None."""
+        row = self._index.get(key)
+        if row is None:
+            return None
+        with self._lock:
+            return self._view()[row]
+
+    def get_many(self, keys):
+        """Return the stored vectors of keys, all present, as one (len(keys), dimensions) array."""
+        rows = [self._index[key] for key in keys]
+        with self._lock:
+            return self._view()[rows]
+
+    def put_many(self, keys, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dimensions)
+        with self._lock, open(self.keys_path, "a", encoding="utf-8") as keys_file:
+            fcntl.flock(keys_file, fcntl.LOCK_EX)
+            try:
+                with open(self.vectors_path, "ab") as vectors_file:
+                    size = vectors_file.tell()
+                    first_row = size // self.row_bytes
+                    if size % self.row_bytes:
+                        # a writer died mid-row; drop the partial row so later rows stay aligned
+                        vectors_file.truncate(first_row * self.row_bytes)
+                    vectors_file.write(vectors.tobytes())
+                    vectors_file.flush()
+                    os.fsync(vectors_file.fileno())
+                keys_file.writelines(f"{key} {first_row + i}\n" for i, key in enumerate(keys))
+                keys_file.flush()
+            finally:
+                fcntl.flock(keys_file, fcntl.LOCK_UN)
+            for i, key in enumerate(keys):
+                self._index[key] = first_row + i
+            self._rows = max(self._rows, first_row + len(keys))
+
+
+class CachedEmbeddings(Embeddings):
+    """LangChain embeddings wrapper that serves repeated texts from an EmbeddingStore.
+
+    Only texts without a stored vector are sent to the wrapped model, in a
+    single batch, so re-ingestion and repeated queries cost no embedding calls.
+    """
+
+    def __init__(self, embeddings, model_name, store=None):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.store = store if store is not None else EmbeddingStore()
+
+    def _embed(self, texts, task, compute):
+        with span("embedding", task=task, texts=len(texts)) as current:
+            keys = [embedding_key(self.model_name, task, text) for text in texts]
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in self.store and key not in missing:
+                    missing[key] = text
+            current.set(cache_hits=len(texts) - len(missing))
+            if missing:
+                vectors = compute(list(missing.values()))
+                self.store.put_many(list(missing.keys()), vectors)
+            # one gather from the memory map and one conversion, instead of a copy per vector
+            return self.store.get_many(keys).tolist()
+
+    def embed_documents(self, texts, *args, **kwargs):
+        return self._embed(texts, "document", lambda missing: get_limiter("embeddings").call(
+            lambda: self.embeddings.embed_documents(missing, *args, **kwargs)))
+
+    def embed_query(self, text, *args, **kwargs):
+        return self._embed([text], "query", lambda missing: [get_limiter("embeddings").call(
+            lambda: self.embeddings.embed_query(missing[0], *args, **kwargs))])[0]
+
+    def embed_queries(self, texts):
+        """Embed several queries; uncached ones go to the model in a single request."""
+        return self._embed(texts, "query", lambda missing: embed_queries(self.embeddings, missing))
+
+    def __getattr__(self, name):
+        # expose the wrapped model's other attributes to callers such as vector stores
+        if name == "embeddings":
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
@@ -0,0 +1,75 @@
+import hashlib
+import json
+import os
+
+
+class IndexManifest:
+    """Record of which resource-library blobs are in the index and under which chunk ids.
+
+    Each entry maps a blob name to its GCS generation, MD5 hash and the ids
+    of the chunks upserted for it, so re-ingestion only touches files that
+    were added, changed or removed since the last run. The manifest is kept
+    as JSON in the bucket next to the library, or in a local file when no
+    bucket is given.
+    """
+
+    def __init__(self, path, bucket=None):
+        self.path = path
+        self.bucket = bucket
+        self.entries = {}
+
+    def load(self):
+        if self.bucket is not None:
+            blob = self.bucket.blob(self.path)
+            if blob.exists():
+                self.entries = json.loads(blob.download_as_text())
+        elif os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        print(f"Manifest loaded with {len(self.entries)} files.")
+        return self
+
+    def save(self):
+        content = json.dumps(self.entries, indent=2, sort_keys=True)
+        if self.bucket is not None:
+            self.bucket.blob(self.path).upload_from_string(content, content_type="application/json")
+        else:
+            with open(self.path, "w", encoding="utf-8") as f:
+                f.write(content)
+        print(f"Manifest saved with {len(self.entries)} files.")
+
+    @property
+    def version(self):
+        """Hash of the entries; it changes whenever a file is indexed, re-indexed or removed."""
+        content = json.dumps(self.entries, sort_keys=True)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def fingerprint(blob):
+        return {"generation": str(blob.generation), "md5": blob.md5_hash}
+
+    def diff(self, blobs):
+        """Split the current blobs into (changed, removed_names).
+
+        ``changed`` holds the blobs that are new or whose generation or MD5
+        differs from the manifest; ``removed_names`` the manifest entries with
+        no matching blob any more.
+        """
+        current = {blob.name: blob for blob in blobs}
+        changed = []
+        for name, blob in current.items():
+            entry = self.entries.get(name)
+            fingerprint = self.fingerprint(blob)
+            if entry is None or any(entry.get(k) != v for k, v in fingerprint.items()):
+                changed.append(blob)
+        removed = [name for name in self.entries if name not in current]
+        return changed, removed
+
+    def chunk_ids(self, name):
+        return self.entries.get(name, {}).get("chunk_ids", [])
+
+    def update(self, blob, chunk_ids):
+        self.entries[blob.name] = {**self.fingerprint(blob), "chunk_ids": list(chunk_ids)}
+
+    def remove(self, name):
+        self.entries.pop(name, None)
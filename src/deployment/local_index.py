@@ -0,0 +1,236 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+load_dotenv()
+
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", ".cache/local_index")
+# IVF partitioning is only worth it for larger corpora; 0 keeps exact search
+LOCAL_INDEX_LISTS = int(os.getenv("LOCAL_INDEX_LISTS", 0))
+LOCAL_INDEX_PROBES = int(os.getenv("LOCAL_INDEX_PROBES", 4))
+
+# everything a search reads, replaced as a whole so readers never see a half-loaded index
+IndexState = namedtuple("IndexState", ["vectors", "docs", "centroids", "assignments", "version"])
+EMPTY_STATE = IndexState(None, [], None, None, None)
+
+
+def top_k(scores, k):
+    """Indexes of the k highest scores, best first, via argpartition."""
+    k = min(k, len(scores))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates])]
+
+
+def kmeans(vectors, n_lists, iterations=10, seed=0):
+    """Lloyd's k-means with dot-product assignment; returns (centroids, assignments)."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        for i in range(n_lists):
+            members = vectors[assignments == i]
+            if len(members):
+                centroids[i] = members.mean(axis=0)
+    return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+
+class LocalVectorIndex(VectorStore):
+    """In-process vector store with exact DOT_PRODUCT top-k over a NumPy matrix.
+
+    Chunk embeddings are persisted as ``embeddings.npy`` and opened as a
+    read-only memory map; texts, metadata and ids are kept in ``docs.json``.
+    Every build is written to its own ``versions/<version>`` directory and
+    published by atomically replacing the ``CURRENT`` file that names it, so
+    a crash or a concurrent reader never sees files from different builds.
+    With ``n_lists`` set, the rows are partitioned by k-means (IVF) and a
+    query only scores the ``n_probes`` closest partitions. As a LangChain
+    VectorStore it provides the same ``as_retriever()`` surface as
+    VectorSearchVectorStore. Writes build a new IndexState and swap it in,
+    so concurrent searches keep using the previous one until then.
+    """
+
+    def __init__(self, embedding, directory=LOCAL_INDEX_DIR, n_lists=LOCAL_INDEX_LISTS,
+                 n_probes=LOCAL_INDEX_PROBES):
+        self.embedding = embedding
+        self.directory = directory
+        self.n_lists = n_lists
+        self.n_probes = n_probes
+        self._lock = threading.Lock()
+        self.state = EMPTY_STATE
+        self.load()
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    def _path(self, name, version=None):
+        if version is None:
+            return os.path.join(self.directory, name)
+        return os.path.join(self.directory, "versions", version, name)
+
+    def _current_version(self):
+        try:
+            with open(self._path("CURRENT"), "r", encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    @property
+    def vectors(self):
+        return self.state.vectors
+
+    @property
+    def docs(self):
+        return self.state.docs
+
+    @property
+    def version(self):
+        """Changes on every rebuild, for callers caching search results."""
+        return self.state.version
+
+    def _read_state(self):
+        version = self._current_version()
+        if version is None:
+            if os.path.exists(self._path("embeddings.npy")):
+                return self._read_legacy_state()
+            return EMPTY_STATE
+        vectors = np.load(self._path("embeddings.npy", version), mmap_mode="r")
+        with open(self._path("docs.json", version), "r", encoding="utf-8") as f:
+            docs = json.load(f)
+        centroids = assignments = None
+        if os.path.exists(self._path("centroids.npy", version)):
+            centroids = np.load(self._path("centroids.npy", version))
+            assignments = np.load(self._path("assignments.npy", version), mmap_mode="r")
+        return IndexState(vectors, docs, centroids, assignments, version)
+
+    def _read_legacy_state(self):
+        # an index written before version directories; the next write moves it to the new layout
+        vectors = np.load(self._path("embeddings.npy"), mmap_mode="r")
+        with open(self._path("docs.json"), "r", encoding="utf-8") as f:
+            docs = json.load(f)
+        return IndexState(vectors, docs, None, None, "legacy")
+
+    def load(self):
+        state = self._read_state()
+        with self._lock:
+            self.state = state
+        return self
+
+    def _save(self, vectors, docs):
+        """Write a new build into its own version directory, publish it, then reopen it."""
+        previous = self._current_version()
+        version = f"{time.time_ns()}-{uuid.uuid4().hex[:8]}"
+        os.makedirs(self._path("", version), exist_ok=True)
+        np.save(self._path("embeddings.npy", version), vectors)
+        with open(self._path("docs.json", version), "w", encoding="utf-8") as f:
+            json.dump(docs, f)
+        if self.n_lists and len(vectors) >= self.n_lists * 8:
+            centroids, assignments = kmeans(vectors, self.n_lists)
+            np.save(self._path("centroids.npy", version), centroids)
+            np.save(self._path("assignments.npy", version), assignments)
+
+        # the single atomic step that switches readers to the new build
+        tmp = self._path(".CURRENT.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(tmp, self._path("CURRENT"))
+
+        # keep the previous build for readers that resolved CURRENT just before the switch
+        for name in os.listdir(self._path("versions")):
+            if name not in (version, previous):
+                shutil.rmtree(os.path.join(self._path("versions"), name), ignore_errors=True)
+        # called with _lock held; searches read the old state until this assignment
+        self.state = self._read_state()
+
+    def add_texts_with_embeddings(self, texts, embeddings, metadatas=None, ids=None,
+                                  is_complete_overwrite=False, **kwargs):
+        metadatas = metadatas or [{} for _ in texts]
+        ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in texts]
+        new_vectors = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            if is_complete_overwrite or self.vectors is None:
+                vectors = np.empty((0, new_vectors.shape[1]), dtype=np.float32)
+                docs = []
+            else:
+                # upsert: drop rows whose ids are being rewritten
+                replaced = set(ids)
+                keep = [i for i, doc in enumerate(self.docs) if doc["id"] not in replaced]
+                vectors = np.asarray(self.vectors[keep])
+                docs = [self.docs[i] for i in keep]
+            vectors = np.concatenate([vectors, new_vectors])
+            docs += [{"id": i, "text": t, "metadata": m} for i, t, m in zip(ids, texts, metadatas)]
+            self._save(vectors, docs)
+        return ids
+
+    def add_texts(self, texts, metadatas=None, ids=None, is_complete_overwrite=False, **kwargs):
+        texts = list(texts)
+        embeddings = self.embedding.embed_documents(texts)
+        return self.add_texts_with_embeddings(texts, embeddings, metadatas, ids, is_complete_overwrite)
+
+    def delete(self, ids=None, **kwargs):
+        if not ids or self.vectors is None:
+            return True
+        removed = set(ids)
+        with self._lock:
+            keep = [i for i, doc in enumerate(self.docs) if doc["id"] not in removed]
+            self._save(np.asarray(self.vectors[keep]), [self.docs[i] for i in keep])
+        return True
+
+    def _candidates(self, state, query):
+        """Rows to score for a query: all of them, or the closest IVF partitions."""
+        if state.centroids is None:
+            return None
+        probes = top_k(state.centroids @ query, self.n_probes)
+        return np.flatnonzero(np.isin(state.assignments, probes))
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, **kwargs):
+        state = self.state
+        vectors, docs = state.vectors, state.docs
+        if vectors is None or not len(docs):
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        rows = self._candidates(state, query)
+        if rows is None:
+            scores = vectors @ query
+            best = top_k(scores, k)
+        else:
+            scores = np.full(len(docs), -np.inf, dtype=np.float32)
+            scores[rows] = vectors[rows] @ query
+            best = top_k(scores[rows], k)
+            best = rows[best]
+        return [(Document(page_content=docs[i]["text"], metadata=docs[i]["metadata"]), float(scores[i]))
+                for i in best]
+
+    # name used by VectorSearchVectorStore
+    def similarity_search_by_vector_with_score(self, embedding, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(embedding, k, **kwargs)
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, **kwargs)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _select_relevance_score_fn(self):
+        # DOT_PRODUCT on normalised embeddings is already a similarity
+        return lambda score: score
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, **kwargs):
+        index = cls(embedding, **kwargs)
+        index.add_texts(texts, metadatas=metadatas, ids=ids, is_complete_overwrite=True)
+        return index
@@ -1,12 +1,16 @@
+import argparse
+import hashlib
 import json
 import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 from dotenv import load_dotenv
-from google.cloud import aiplatform, storage
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_google_vertexai import (VectorSearchVectorStore,
-                                       VertexAIEmbeddings)
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from src.clients import get_embeddings, get_storage_client
+from src.deployment.index_manifest import IndexManifest
+from src.deployment.local_index import LOCAL_INDEX_DIR, LocalVectorIndex
 
 load_dotenv()
 
@@ -15,32 +19,53 @@ PROJECT_ID = os.getenv("PROJECT_ID")
 REGION = os.getenv("REGION")
 INDEX_ID = os.getenv("INDEX_ID")
 ENDPOINT_ID = os.getenv("ENDPOINT_ID")
+# "matching_engine" (Vertex AI Vector Search endpoint) or "local" (in-process NumPy index)
+VECTOR_SEARCH_BACKEND = os.getenv("VECTOR_SEARCH_BACKEND", "matching_engine")
 
-aiplatform.init(project=PROJECT_ID, location=REGION)
-
-RESOURCES_LINKS_PATH = "../dependencies/resource_links.json"
+RESOURCES_LINKS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dependencies", "resource_links.json")
 DOCUMENT_FOLDER = "resource-library"  
+MANIFEST_PATH = f"{DOCUMENT_FOLDER}-manifest.json"
 CHUNK_SIZE = 500  
 CHUNK_OVERLAP = 50  
-EMBEDDING_MODEL = VertexAIEmbeddings(model_name="text-embedding-005")
+DOWNLOAD_WORKERS = int(os.getenv("INGEST_DOWNLOAD_WORKERS", 8))
+PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS", os.cpu_count() or 1))
+EMBEDDING_BATCH_SIZE = int(os.getenv("INGEST_EMBEDDING_BATCH_SIZE", 64))
+EMBEDDING_CONCURRENCY = int(os.getenv("INGEST_EMBEDDING_CONCURRENCY", 4))
+EMBEDDING_MODEL_NAME = "text-embedding-005"
+# how often a running app re-reads the manifest to notice a re-ingested library
+INDEX_VERSION_TTL = float(os.getenv("INDEX_VERSION_TTL", 300))
+
+def list_pdf_blobs(bucket_name, folder):
+    """List the PDF blobs in the specified GCP bucket folder."""
+    bucket = get_storage_client().bucket(bucket_name)
+    return [blob for blob in bucket.list_blobs(prefix=folder) if blob.name.endswith(".pdf")]
 
-storage_client = storage.Client()
+def download_blobs(blobs, destination=".", max_workers=DOWNLOAD_WORKERS):
+    """Download blobs concurrently and return their local paths."""
+    def download(blob):
+        # one directory per blob, so files with the same name under different prefixes do not collide
+        local_dir = os.path.join(destination, blob_key(blob.name))
+        os.makedirs(local_dir, exist_ok=True)
+        local_path = os.path.join(local_dir, os.path.basename(blob.name))
+        blob.download_to_filename(local_path)
+        print(f"Downloaded {local_path}")
+        return local_path
 
-def download_pdfs(bucket_name, folder):
-    """Download PDFs from the specified GCP bucket folder."""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(download, blobs))
+
+def download_pdfs(bucket_name, folder, destination=".", max_workers=DOWNLOAD_WORKERS):
+    """Download PDFs from the specified GCP bucket folder concurrently."""
     print("Downloading PDFs from GCP bucket...")
-    bucket = storage_client.bucket(bucket_name)
-    blobs = bucket.list_blobs(prefix=folder)
+    return download_blobs(list_pdf_blobs(bucket_name, folder), destination, max_workers)
 
-    local_files = []
-    for blob in blobs:
-        if blob.name.endswith(".pdf"):
-            local_path = os.path.basename(blob.name)
-            blob.download_to_filename(local_path)
-            local_files.append(local_path)
-            print(f"Downloaded {local_path}")
+def blob_key(blob_name):
+    """Short hash of the full blob name, unique per object in the bucket."""
+    return hashlib.md5(blob_name.encode('utf-8')).hexdigest()[:16]
 
-    return local_files
+def chunk_id(blob_name, chunk_index):
+    """Stable datapoint id for a chunk, so re-ingesting a file overwrites its chunks."""
+    return f"{blob_key(blob_name)}-{chunk_index}"
 
 def get_pdf_links():
     """Load PDF links from the JSON file."""
@@ -56,43 +81,74 @@ def get_pdf_links():
         print(f"Error decoding JSON from {RESOURCES_LINKS_PATH}: {e}")
         return {}
 
-def preprocess_pdfs(pdf_files):
-    """Preprocess PDFs to extract text chunks and metadata."""
-    all_texts = []
-    all_metadatas = []
+def split_pdf(file_path, pdf_links, source=None):
+    """Parse one PDF and split it into text chunks with metadata.
+
+    ``source`` is the full blob name, recorded on every chunk when given.
+    """
+    from langchain_community.document_loaders import PyPDFLoader
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    file_name = os.path.basename(file_path)
+    print(f"Processing {file_name}...")
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=CHUNK_SIZE,
         chunk_overlap=CHUNK_OVERLAP,
         length_function=len,
         is_separator_regex=False,
     )
+    loader = PyPDFLoader(file_path)
+    pages = loader.load()
 
-    pdf_links = get_pdf_links()
-
-    for file_name in pdf_files:
-        print(f"Processing {file_name}...")
-        loader = PyPDFLoader(file_name)
-        pages = loader.load()
+    doc_splits = text_splitter.split_documents(pages)
 
-        doc_splits = text_splitter.split_documents(pages)
+    texts = [doc.page_content for doc in doc_splits]
+    metadatas = [
+        {
+            "file_name": file_name,
+            "page_number": doc.metadata.get("page_number", None),
+            "chunk_index": idx,
+            "title": file_name.replace(".pdf", ""),
+            "link": pdf_links.get(file_name, "Unknown"),
+            **({"source": source} if source is not None else {}),
+        }
+        for idx, doc in enumerate(doc_splits)
+    ]
+    return texts, metadatas
 
-        texts = [doc.page_content for doc in doc_splits]
-        metadatas = [
-            {
-                "file_name": file_name,
-                "page_number": doc.metadata.get("page_number", None),
-                "chunk_index": idx,
-                "title": file_name.replace(".pdf", ""),
-                "link": pdf_links.get(file_name, "Unknown"),
-            }
-            for idx, doc in enumerate(doc_splits)
-        ]
+def preprocess_pdfs(pdf_files, max_workers=PARSE_WORKERS, sources=None):
+    """Preprocess PDFs to extract text chunks and metadata across a process pool."""
+    all_texts = []
+    all_metadatas = []
+    pdf_links = get_pdf_links()
+    sources = sources or [None] * len(pdf_files)
 
-        all_texts.extend(texts)
-        all_metadatas.extend(metadatas)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(split_pdf, pdf_files, [pdf_links] * len(pdf_files), sources)
+        for texts, metadatas in results:
+            all_texts.extend(texts)
+            all_metadatas.extend(metadatas)
 
     return all_texts, all_metadatas
 
+def embed_texts(texts, embedding_model, batch_size=EMBEDDING_BATCH_SIZE,
+                max_concurrency=EMBEDDING_CONCURRENCY):
+    """Embed texts in batches, with up to max_concurrency requests in flight."""
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        results = executor.map(
+            lambda batch: embedding_model.embed_documents(batch, batch_size=len(batch)), batches)
+        return [embedding for batch in results for embedding in batch]
+
+def report_throughput(stage, seconds, documents=None, chunks=None):
+    """Print how long a stage took and its documents/s and chunks/s."""
+    rates = []
+    if documents is not None:
+        rates.append(f"{documents} docs, {documents / max(seconds, 1e-9):.2f} docs/s")
+    if chunks is not None:
+        rates.append(f"{chunks} chunks, {chunks / max(seconds, 1e-9):.2f} chunks/s")
+    print(f"[{stage}] {seconds:.2f}s: " + "; ".join(rates))
+
 def delete_local_files(file_paths):
     """Delete local files after processing."""
     print("Deleting local files...")
@@ -106,49 +162,183 @@ def delete_local_files(file_paths):
             print(f"Error deleting {file_path}: {e}")
 
 class VectorSearch:
-    """Vector Search class for managing the vector store."""
-
-    def __init__(self, index_id, endpoint_id, embedding_model):
-        self.vector_store = VectorSearchVectorStore.from_components(
-            project_id=PROJECT_ID,
-            region=REGION,
-            gcs_bucket_name=BUCKET_NAME,
-            index_id=index_id,
-            endpoint_id=endpoint_id,
-            embedding=embedding_model,
-        )
+    """Vector Search class for managing the vector store.
+
+    The "local" backend keeps the index in process with LocalVectorIndex, so
+    retrieval needs no deployed endpoint or network hop.
+    """
+
+    def __init__(self, index_id, endpoint_id, embedding_model, backend=VECTOR_SEARCH_BACKEND):
+        self.backend = backend
+        self._version = None
+        self._version_checked_at = 0.0
+        if backend == "local":
+            self.vector_store = LocalVectorIndex(embedding_model)
+        else:
+            from google.cloud import aiplatform
+            from langchain_google_vertexai import VectorSearchVectorStore
+
+            aiplatform.init(project=PROJECT_ID, location=REGION)
+            self.vector_store = VectorSearchVectorStore.from_components(
+                project_id=PROJECT_ID,
+                region=REGION,
+                gcs_bucket_name=BUCKET_NAME,
+                index_id=index_id,
+                endpoint_id=endpoint_id,
+                embedding=embedding_model,
+            )
         print("Vector store initialized.")
 
+    def index_version(self):
+        """Version of the indexed content, used to key cached search results.
+
+        The local index reports its own version. For a Vector Search endpoint
+        it is the version of the ingestion manifest in the bucket, re-read at
+        most every INDEX_VERSION_TTL seconds. None means results should not
+        be cached.
+        """
+        if self.backend == "local":
+            return self.vector_store.version
+        if self._version is None or time.monotonic() - self._version_checked_at > INDEX_VERSION_TTL:
+            # checked again after the TTL even on failure, so a GCS outage is not retried on every call
+            self._version_checked_at = time.monotonic()
+            try:
+                manifest = IndexManifest(MANIFEST_PATH, bucket=get_storage_client().bucket(BUCKET_NAME))
+                self._version = manifest.load().version
+            except Exception as e:
+                # only a cache key: keep the last known version, or skip caching if there is none
+                print(f"Could not read the index manifest, keeping version {self._version}: {e}")
+        return self._version
+
     def add_texts(self, texts, metadatas, is_complete_overwrite=True):
         """Add texts and metadata to the vector store."""
         print("Adding docs to vector store...")
         self.vector_store.add_texts(texts=texts, metadatas=metadatas, is_complete_overwrite=is_complete_overwrite)
         print("Docs added successfully.")
 
-if __name__ == "__main__":
-    
-    #preprocess resources pdfs
-    pdf_files = download_pdfs(BUCKET_NAME, DOCUMENT_FOLDER)
-    texts, metadatas = preprocess_pdfs(pdf_files)
-    delete_local_files(pdf_files)
+    def add_texts_with_embeddings(self, texts, embeddings, metadatas, ids=None, is_complete_overwrite=True):
+        """Add precomputed embeddings, texts and metadata to the vector store."""
+        print("Adding embedded docs to vector store...")
+        self.vector_store.add_texts_with_embeddings(
+            texts=texts, embeddings=embeddings, metadatas=metadatas, ids=ids,
+            is_complete_overwrite=is_complete_overwrite)
+        print("Docs added successfully.")
 
-    print(f"Processed {len(texts)} chunks.")
-    print(f"Sample Text: {texts[0]}")
-    print(f"Sample Metadata: {metadatas[0]}")
+    def delete(self, ids):
+        """Remove datapoints from the index by id."""
+        if ids:
+            print(f"Deleting {len(ids)} docs from vector store...")
+            self.vector_store.delete(ids=ids)
 
-    # #create and update vector search
-    EMBEDDING_MODEL = VertexAIEmbeddings(model_name="text-embedding-005")
+def run_ingestion(bucket_name, folder, vector_search=None, embedding_model=None):
+    """Download, parse, embed and upload the resource library, reporting per-stage throughput."""
+    embedding_model = embedding_model or get_embeddings(EMBEDDING_MODEL_NAME)
+    with tempfile.TemporaryDirectory() as workdir:
+        start = time.perf_counter()
+        pdf_files = download_pdfs(bucket_name, folder, destination=workdir)
+        report_throughput("download", time.perf_counter() - start, documents=len(pdf_files))
+
+        start = time.perf_counter()
+        texts, metadatas = preprocess_pdfs(pdf_files)
+        report_throughput("parse", time.perf_counter() - start,
+                          documents=len(pdf_files), chunks=len(texts))
+
+    start = time.perf_counter()
+    embeddings = embed_texts(texts, embedding_model)
+    report_throughput("embed", time.perf_counter() - start, chunks=len(texts))
+
+    if vector_search is not None:
+        start = time.perf_counter()
+        vector_search.add_texts_with_embeddings(texts, embeddings, metadatas)
+        report_throughput("upsert", time.perf_counter() - start, chunks=len(texts))
+
+    return texts, metadatas, embeddings
+
+def run_incremental_ingestion(bucket_name, folder, vector_search, embedding_model=None,
+                              manifest=None, full_rebuild=False):
+    """Re-index only the PDFs added, changed or removed since the last run.
+
+    Changed files are parsed, embedded and upserted under stable chunk ids;
+    chunks of removed files, and surplus chunks of files that shrank, are
+    deleted. The manifest is saved after the index has been updated. With
+    full_rebuild every file is re-embedded and the index is overwritten.
+    """
+    embedding_model = embedding_model or get_embeddings(EMBEDDING_MODEL_NAME)
+    if manifest is None:
+        manifest = IndexManifest(MANIFEST_PATH, bucket=get_storage_client().bucket(bucket_name))
+    manifest.load()
+    if full_rebuild:
+        manifest.entries = {}
+    changed, removed = manifest.diff(list_pdf_blobs(bucket_name, folder))
+    print(f"{len(changed)} new or changed files, {len(removed)} removed files.")
+
+    texts, metadatas, ids = [], [], []
+    if changed:
+        with tempfile.TemporaryDirectory() as workdir:
+            start = time.perf_counter()
+            pdf_files = download_blobs(changed, destination=workdir)
+            report_throughput("download", time.perf_counter() - start, documents=len(pdf_files))
+
+            start = time.perf_counter()
+            texts, metadatas = preprocess_pdfs(pdf_files, sources=[blob.name for blob in changed])
+            report_throughput("parse", time.perf_counter() - start,
+                              documents=len(pdf_files), chunks=len(texts))
+
+        ids = [chunk_id(m["source"], m["chunk_index"]) for m in metadatas]
 
+        start = time.perf_counter()
+        embeddings = embed_texts(texts, embedding_model)
+        report_throughput("embed", time.perf_counter() - start, chunks=len(texts))
+
+        start = time.perf_counter()
+        vector_search.add_texts_with_embeddings(
+            texts, embeddings, metadatas, ids=ids, is_complete_overwrite=full_rebuild)
+        report_throughput("upsert", time.perf_counter() - start, chunks=len(texts))
+
+    new_ids = set(ids)
+    stale_ids = [i for name in removed for i in manifest.chunk_ids(name)]
+    stale_ids += [i for blob in changed for i in manifest.chunk_ids(blob.name) if i not in new_ids]
+    vector_search.delete(stale_ids)
+
+    for blob in changed:
+        manifest.update(blob, [i for i, m in zip(ids, metadatas) if m["source"] == blob.name])
+    for name in removed:
+        manifest.remove(name)
+    manifest.save()
+
+    return texts, metadatas
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest the resource library into vector search.")
+    parser.add_argument("--full-rebuild", action="store_true",
+                        help="re-embed every PDF and overwrite the whole index")
+    parser.add_argument("--backend", choices=["matching_engine", "local"], default=VECTOR_SEARCH_BACKEND,
+                        help="index to update (default: VECTOR_SEARCH_BACKEND)")
+    args = parser.parse_args()
+
+    # #create and update vector search
     print("Creating vector store...")
     vector_search = VectorSearch(
         index_id=INDEX_ID, 
         endpoint_id=ENDPOINT_ID, 
-        embedding_model=EMBEDDING_MODEL
+        embedding_model=get_embeddings(EMBEDDING_MODEL_NAME),
+        backend=args.backend,
         )
     print("Vector store created.")
 
+    # the local index lives on this machine, so its manifest does too
+    manifest = None
+    if args.backend == "local":
+        os.makedirs(LOCAL_INDEX_DIR, exist_ok=True)
+        manifest = IndexManifest(os.path.join(LOCAL_INDEX_DIR, "manifest.json"))
+
+    #preprocess resources pdfs, embed them and update vector search
     print("Updating vector store...")
-    ## this can take over an hour
-    # vector_search.add_texts(
-    #     texts=texts, metadatas=metadatas, is_complete_overwrite=True)
+    texts, metadatas = run_incremental_ingestion(
+        BUCKET_NAME, DOCUMENT_FOLDER, vector_search, manifest=manifest, full_rebuild=args.full_rebuild)
+
+    print(f"Processed {len(texts)} chunks.")
+    if texts:
+        print(f"Sample Text: {texts[0]}")
+        print(f"Sample Metadata: {metadatas[0]}")
     print("Vector store updated.")
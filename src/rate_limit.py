@@ -0,0 +1,218 @@
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", 5))
+# (requests per minute, tokens per minute or None, initial concurrency) per service,
+# each overridable with RATE_LIMIT_<NAME>_RPM, _TPM and _CONCURRENCY
+DEFAULT_LIMITS = {
+    "chat": (60, 1_000_000, 8),
+    "sentiment": (60, None, 8),
+    "embeddings": (600, None, 8),
+    "speech": (300, None, 8),
+}
+# HTTP statuses of quota and overload errors, as exposed by google.api_core exceptions
+THROTTLED_CODES = {429, 503}
+THROTTLED_NAMES = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable"}
+
+
+class RateLimitError(Exception):
+    """Raised when a call is still throttled after every retry."""
+
+    def __init__(self, name, error):
+        super().__init__(f"{name} quota exceeded, try again in a minute ({error})")
+        self.name = name
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token) without an API call."""
+    return len(text) // 4 + 1
+
+
+def is_throttled(error):
+    """True for quota and overload errors, judged by exception type or status code only."""
+    if any(cls.__name__ in THROTTLED_NAMES for cls in type(error).__mro__):
+        return True
+    code = getattr(error, "code", None)
+    if callable(code):
+        # grpc errors expose the status as a method
+        code = getattr(code(), "name", None)
+    # HTTP client errors carry the status on their response
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    return code in THROTTLED_CODES or code in ("RESOURCE_EXHAUSTED", "UNAVAILABLE") or status in THROTTLED_CODES
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at rate_per_minute.
+
+    It holds up to ten seconds of budget, so short bursts are allowed
+    without exceeding the per-minute quota.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or max(1.0, rate_per_minute / 6.0)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        # a single request larger than the bucket waits for a full bucket
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveConcurrency:
+    """Concurrency limit with AIMD: +1 per limit's worth of successes, halved on throttling."""
+
+    def __init__(self, initial, minimum=1, maximum=None):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum or initial * 4
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit / 2)
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class RateLimiter:
+    """Shared gate in front of one model or endpoint.
+
+    A call waits for a request token, for its estimated prompt tokens and
+    for a concurrency slot. Throttled calls are retried with exponential
+    backoff and jitter, and they shrink the concurrency limit.
+    """
+
+    def __init__(self, name, requests_per_minute, tokens_per_minute=None, concurrency=8,
+                 max_retries=RATE_LIMIT_MAX_RETRIES):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.concurrency = AdaptiveConcurrency(concurrency)
+        self.max_retries = max_retries
+        self.stats = {"calls": 0, "throttled": 0, "failed": 0}
+
+    @contextmanager
+    def slot(self, tokens=0):
+        """Hold one rate-limited slot for the duration of the block, without retrying."""
+        self.requests.acquire()
+        if self.tokens is not None and tokens:
+            self.tokens.acquire(tokens)
+        self.concurrency.acquire()
+        throttled = False
+        try:
+            yield
+        except Exception as e:
+            throttled = is_throttled(e)
+            raise
+        finally:
+            self.concurrency.release(throttled)
+            self.stats["calls"] += 1
+            if throttled:
+                self.stats["throttled"] += 1
+
+    def backoff(self, attempt):
+        time.sleep(min(30, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.5))
+
+    def call(self, func, tokens=0):
+        """Return func(), retrying while the service throttles it."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.slot(tokens):
+                    return func()
+            except Exception as e:
+                if not is_throttled(e):
+                    raise
+                if attempt == self.max_retries:
+                    self.stats["failed"] += 1
+                    raise RateLimitError(self.name, e) from e
+                print(f"{self.name} throttled, retrying (attempt {attempt + 1}): {e}")
+                self.backoff(attempt)
+
+    def stream(self, func, tokens=0):
+        """Yield from func(), retrying a throttled stream only if it has not yielded anything yet."""
+        for attempt in range(self.max_retries + 1):
+            started = False
+            try:
+                with self.slot(tokens):
+                    for item in func():
+                        started = True
+                        yield item
+                return
+            except Exception as e:
+                if started or not is_throttled(e):
+                    raise
+                if attempt == self.max_retries:
+                    self.stats["failed"] += 1
+                    raise RateLimitError(self.name, e) from e
+                print(f"{self.name} throttled, retrying (attempt {attempt + 1}): {e}")
+                self.backoff(attempt)
+
+
+class _Unlimited:
+    """Stand-in used when RATE_LIMIT_ENABLED is off."""
+
+    @contextmanager
+    def slot(self, tokens=0):
+        yield
+
+    def call(self, func, tokens=0):
+        return func()
+
+    def stream(self, func, tokens=0):
+        yield from func()
+
+
+_limiters = {}
+_lock = threading.Lock()
+
+
+def get_limiter(name):
+    """Process-wide limiter for one of the DEFAULT_LIMITS services."""
+    limiter = _limiters.get(name)
+    if limiter is None:
+        with _lock:
+            limiter = _limiters.get(name)
+            if limiter is None:
+                if not RATE_LIMIT_ENABLED:
+                    limiter = _Unlimited()
+                else:
+                    rpm, tpm, concurrency = DEFAULT_LIMITS[name]
+                    prefix = f"RATE_LIMIT_{name.upper()}"
+                    limiter = RateLimiter(
+                        name,
+                        requests_per_minute=int(os.getenv(f"{prefix}_RPM", rpm)),
+                        tokens_per_minute=int(os.getenv(f"{prefix}_TPM", tpm or 0)) or None,
+                        concurrency=int(os.getenv(f"{prefix}_CONCURRENCY", concurrency)),
+                    )
+                _limiters[name] = limiter
+    return limiter
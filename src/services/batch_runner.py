@@ -0,0 +1,243 @@
+import argparse
+import glob
+import json
+import os
+import statistics
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from src import utils
+from src.clients import get_storage_client
+from src.tracing import span, start_metrics_server, trace_session
+
+from .db_handler import BigQueryConnector, progress_note_columns
+from .session_pipeline import SessionPipeline
+from .speech_inference import SpeechToText, is_streamable
+from .template_registry import get_template_registry
+
+load_dotenv()
+
+AUDIO_EXTENSIONS = (".mp3", ".mp4", ".wav", ".m4a")
+AUDIO_BUCKET = "therapy_audio"
+# default number of calls in flight per stage, across all sessions
+STAGE_CONCURRENCY = {
+    "transcribe": 4,
+    "case_notes": 4,
+    "progress_notes": 4,
+    "sentiment": 8,
+    "resource_links": 4,
+    # the single call that replaces the LLM stages with --combined
+    "combined": 4,
+}
+
+
+def list_audio(source):
+    """Audio files under a local directory or a gs://bucket/prefix, as paths or gs:// URIs."""
+    if source.startswith("gs://"):
+        bucket_name, _, prefix = source[5:].partition("/")
+        blobs = get_storage_client().bucket(bucket_name).list_blobs(prefix=prefix)
+        return sorted(f"gs://{bucket_name}/{blob.name}" for blob in blobs
+                      if blob.name.lower().endswith(AUDIO_EXTENSIONS))
+    return sorted(path for path in glob.glob(os.path.join(source, "**", "*"), recursive=True)
+                  if path.lower().endswith(AUDIO_EXTENSIONS))
+
+
+def session_id_for(audio):
+    """Stable session id for a recording, so a re-run maps it to the same session."""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, os.path.abspath(audio) if not audio.startswith("gs://") else audio))
+
+
+def percentile(values, q):
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+class ThrottledPipeline(SessionPipeline):
+    """SessionPipeline whose stages each wait for a slot of a semaphore shared by the whole batch."""
+
+    def __init__(self, transcript, template, limits, **kwargs):
+        super().__init__(transcript, template, **kwargs)
+        self.limits = limits
+
+    def _timed(self, stage, func):
+        with self.limits[stage]:
+            return super()._timed(stage, func)
+
+
+class BatchRunner:
+    """Processes a backlog of recordings end to end without the UI.
+
+    Every session is transcribed, run through the LLM stages and written to
+    BigQuery. Completed sessions are appended to a JSONL results file, which
+    doubles as the resume state: a re-run skips every recording already in
+    it. Rows are inserted synchronously, so a session is only recorded once
+    BigQuery has accepted them. Sessions whose case notes, progress notes or
+    sentiment failed are not recorded, so they are retried.
+    """
+
+    def __init__(self, results_path, template="soap", therapist_id=None, client_name="Batch",
+                 sessions=8, stage_concurrency=None, streaming_stt=False, combined=False,
+                 bucket=AUDIO_BUCKET, write_to_bigquery=True):
+        self.results_path = results_path
+        self.template = get_template_registry().get(template)
+        self.therapist_id = therapist_id or str(uuid.uuid4())
+        self.client_name = client_name
+        self.sessions = sessions
+        concurrency = {**STAGE_CONCURRENCY, **(stage_concurrency or {})}
+        self.limits = {stage: threading.BoundedSemaphore(n) for stage, n in concurrency.items()}
+        self.streaming_stt = streaming_stt
+        self.combined = combined
+        self.bucket = bucket
+        # not write-behind: the results file must never get ahead of what BigQuery has stored
+        self.db_connector = BigQueryConnector(write_behind=False, raise_on_error=True) if write_to_bigquery else None
+        self.timings = {stage: [] for stage in concurrency}
+        self._lock = threading.Lock()
+
+    def completed(self):
+        """Recordings already processed according to the results file."""
+        done = set()
+        if os.path.exists(self.results_path):
+            with open(self.results_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        done.add(json.loads(line)["audio"])
+                    except (ValueError, KeyError):
+                        continue
+        return done
+
+    def transcribe(self, audio, session_id):
+        # streaming only takes WAV; other formats fall back to batch recognition
+        streaming = self.streaming_stt and is_streamable(audio)
+        if not audio.startswith("gs://") and not streaming:
+            # long_running_recognize only reads audio from GCS
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            extension = os.path.splitext(audio)[1]
+            audio = utils.upload_to_gcs(self.bucket, audio, f"audio_files/{session_id}/audio_{timestamp}{extension}")
+        return SpeechToText(audio, session_id=session_id).transcribe(streaming=streaming)
+
+    def process(self, audio):
+        session_id = session_id_for(audio)
+        with trace_session(session_id), span("session", source="batch", audio=audio):
+            return self._process(audio, session_id)
+
+    def _process(self, audio, session_id):
+        client_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"client:{session_id}"))
+
+        with self.limits["transcribe"]:
+            start = time.perf_counter()
+            transcript = self.transcribe(audio, session_id)
+            transcribe_seconds = time.perf_counter() - start
+
+        result = ThrottledPipeline(transcript, self.template, self.limits, combined=self.combined).run()
+        if result.case_notes is None:
+            raise RuntimeError(f"case notes failed: {result.case_notes_error()}")
+        # checked before any insert, so a retried session does not duplicate its case-notes row
+        for stage in ("progress_notes", "sentiment"):
+            if getattr(result, stage) is None:
+                raise RuntimeError(f"{stage} failed: {result.errors.get(stage)}")
+
+        if self.db_connector is not None:
+            self.db_connector.insert_case_notes(session_id, client_id, self.client_name,
+                                                self.therapist_id, str(result.case_notes))
+            self.db_connector.insert_progress_notes(
+                session_id, client_id, self.client_name, self.therapist_id,
+                *progress_note_columns(result.progress_notes['progress_notes'][0]), result.sentiment)
+
+        timings = {"transcribe": transcribe_seconds, **result.timings}
+        record = {
+            "audio": audio,
+            "session_id": session_id,
+            "case_notes": result.case_notes,
+            "progress_notes": result.progress_notes,
+            "sentiment": result.sentiment,
+            "resource_links": result.resource_links,
+            "errors": {stage: str(error) for stage, error in result.errors.items()},
+            "timings": timings,
+            "completed_at": datetime.now().isoformat(),
+        }
+        with self._lock:
+            for stage, seconds in timings.items():
+                self.timings.setdefault(stage, []).append(seconds)
+            with open(self.results_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+        return record
+
+    def run(self, source):
+        audio_files = list_audio(source)
+        done = self.completed()
+        pending = [audio for audio in audio_files if audio not in done]
+        print(f"{len(audio_files)} recordings, {len(audio_files) - len(pending)} already done, "
+              f"{len(pending)} to process.")
+
+        succeeded, failed = 0, 0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.sessions) as executor:
+            futures = {executor.submit(self.process, audio): audio for audio in pending}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    succeeded += 1
+                    print(f"[{succeeded + failed}/{len(pending)}] done {futures[future]}")
+                except Exception:
+                    failed += 1
+                    print(f"[{succeeded + failed}/{len(pending)}] failed {futures[future]}:\n"
+                          f"{traceback.format_exc()}")
+        elapsed = time.perf_counter() - start
+        self.report(succeeded, failed, elapsed)
+        return succeeded, failed
+
+    def report(self, succeeded, failed, elapsed):
+        print(f"{succeeded} sessions processed, {failed} failed in {elapsed:.1f}s "
+              f"({succeeded / max(elapsed, 1e-9) * 60:.2f} sessions/min)")
+        for stage, values in self.timings.items():
+            if values:
+                print(f"  {stage:<15} p50 {percentile(values, 50):7.2f}s  p90 {percentile(values, 90):7.2f}s  "
+                      f"p99 {percentile(values, 99):7.2f}s  n={len(values)}")
+
+
+def stage_limit(value):
+    stage, _, n = value.partition("=")
+    if stage not in STAGE_CONCURRENCY or not n.isdigit() or int(n) < 1:
+        raise argparse.ArgumentTypeError(f"expected STAGE=N with STAGE in {', '.join(STAGE_CONCURRENCY)}")
+    return stage, int(n)
+
+
+if __name__ == "__main__":
+    # python -m src.services.batch_runner recordings/ --results results.jsonl
+    parser = argparse.ArgumentParser(description="Process a directory or GCS prefix of recorded sessions.")
+    parser.add_argument("source", help="local directory or gs://bucket/prefix of audio files")
+    parser.add_argument("--results", default="batch_results.jsonl",
+                        help="JSONL file of completed sessions, also used to resume")
+    parser.add_argument("--template", default="soap", choices=get_template_registry().names())
+    parser.add_argument("--therapist-id")
+    parser.add_argument("--client-name", default="Batch")
+    parser.add_argument("--sessions", type=int, default=8, help="sessions processed at once")
+    parser.add_argument("--concurrency", action="append", type=stage_limit, default=[], metavar="STAGE=N",
+                        help=f"calls in flight for a stage, e.g. transcribe=2 (stages: {', '.join(STAGE_CONCURRENCY)})")
+    parser.add_argument("--streaming-stt", action="store_true")
+    parser.add_argument("--combined", action="store_true", help="one LLM call for all stages")
+    parser.add_argument("--bucket", default=AUDIO_BUCKET, help="bucket local recordings are uploaded to")
+    parser.add_argument("--no-bigquery", action="store_true", help="only write the results file")
+    args = parser.parse_args()
+
+    start_metrics_server()
+    runner = BatchRunner(
+        args.results,
+        template=args.template,
+        therapist_id=args.therapist_id,
+        client_name=args.client_name,
+        sessions=args.sessions,
+        stage_concurrency=dict(args.concurrency),
+        streaming_stt=args.streaming_stt,
+        combined=args.combined,
+        bucket=args.bucket,
+        write_to_bigquery=not args.no_bigquery,
+    )
+    runner.run(args.source)
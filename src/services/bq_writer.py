@@ -0,0 +1,237 @@
+import atexit
+import json
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+
+from dotenv import load_dotenv
+
+from src.tracing import span
+
+load_dotenv()
+
+BQ_BATCH_SIZE = int(os.getenv("BQ_BATCH_SIZE", 50))
+BQ_FLUSH_INTERVAL_SECONDS = float(os.getenv("BQ_FLUSH_INTERVAL_SECONDS", 2.0))
+BQ_MAX_RETRIES = int(os.getenv("BQ_MAX_RETRIES", 5))
+BQ_DEAD_LETTER_DIR = os.getenv("BQ_DEAD_LETTER_DIR", ".dead_letter")
+# dead-lettered rows are clinical notes in plaintext, so their files are deleted after this long
+BQ_DEAD_LETTER_TTL_SECONDS = float(os.getenv("BQ_DEAD_LETTER_TTL_SECONDS", 7 * 24 * 60 * 60))
+# "insert_all" (legacy streaming inserts) or "storage_write" (Storage Write API)
+BQ_WRITE_BACKEND = os.getenv("BQ_WRITE_BACKEND", "insert_all")
+
+_STOP = object()
+
+
+class BigQueryWriteError(Exception):
+    """Raised by a backend when some or all rows of a batch were rejected.
+
+    ``failed_indexes`` holds the positions of the rejected rows, so only
+    those are retried.
+    """
+
+    def __init__(self, message, failed_indexes=None):
+        super().__init__(message)
+        self.failed_indexes = failed_indexes
+
+
+class InsertAllBackend:
+    """Writes batches with ``insert_rows_json``; row ids let BigQuery dedupe retries."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def write(self, table_id, rows):
+        row_ids = [row_id for row_id, _ in rows]
+        errors = self.client.insert_rows_json(table_id, [row for _, row in rows], row_ids=row_ids)
+        if errors:
+            raise BigQueryWriteError(f"Failed to insert rows: {errors}",
+                                     failed_indexes=sorted({e["index"] for e in errors}))
+
+
+class StorageWriteBackend:
+    """Writes batches to each table's default stream with the Storage Write API.
+
+    The proto schema is derived from the row keys, with every column sent as a
+    string, which covers the STRING and TIMESTAMP columns written by this app.
+    """
+
+    def __init__(self):
+        from google.cloud import bigquery_storage_v1
+
+        self.types = bigquery_storage_v1.types
+        self.client = bigquery_storage_v1.BigQueryWriteClient()
+        self._message_classes = {}
+
+    def _message_class(self, columns):
+        from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+
+        entry = self._message_classes.get(columns)
+        if entry is None:
+            name = f"row_{len(self._message_classes)}"
+            descriptor_proto = descriptor_pb2.DescriptorProto(name="Row")
+            for number, column in enumerate(columns, start=1):
+                descriptor_proto.field.add(
+                    name=column, number=number,
+                    type=descriptor_pb2.FieldDescriptorProto.TYPE_STRING,
+                    label=descriptor_pb2.FieldDescriptorProto.LABEL_OPTIONAL,
+                )
+            file_proto = descriptor_pb2.FileDescriptorProto(name=f"{name}.proto", package=name)
+            file_proto.message_type.add().CopyFrom(descriptor_proto)
+            pool = descriptor_pool.DescriptorPool()
+            pool.Add(file_proto)
+            message_class = message_factory.GetMessageClass(
+                pool.FindMessageTypeByName(f"{name}.Row"))
+            entry = self._message_classes[columns] = (message_class, descriptor_proto)
+        return entry
+
+    def write(self, table_id, rows):
+        project, dataset, table = table_id.split(".")
+        columns = tuple(sorted(rows[0][1].keys()))
+        message_class, descriptor_proto = self._message_class(columns)
+
+        proto_rows = self.types.ProtoRows()
+        for _, row in rows:
+            message = message_class(**{k: str(v) for k, v in row.items() if v is not None})
+            proto_rows.serialized_rows.append(message.SerializeToString())
+
+        request = self.types.AppendRowsRequest(
+            write_stream=f"projects/{project}/datasets/{dataset}/tables/{table}/streams/_default",
+            proto_rows=self.types.AppendRowsRequest.ProtoData(
+                writer_schema=self.types.ProtoSchema(proto_descriptor=descriptor_proto),
+                rows=proto_rows,
+            ),
+        )
+        for response in self.client.append_rows(iter([request])):
+            if response.row_errors:
+                raise BigQueryWriteError(
+                    f"Failed to append rows: {list(response.row_errors)}",
+                    failed_indexes=sorted({e.index for e in response.row_errors}))
+            if response.error.code:
+                raise BigQueryWriteError(f"Failed to append rows: {response.error.message}")
+
+
+class BigQueryWriter:
+    """Write-behind buffer that batches rows per table on a background thread.
+
+    ``write`` only enqueues, so callers never wait on BigQuery. Batches are
+    flushed when they reach ``batch_size`` rows or are older than
+    ``flush_interval`` seconds, retried with exponential backoff, and
+    appended to a per-day JSONL file in ``dead_letter_dir`` if they keep
+    failing. Dead-letter files are readable by the owner only and are
+    deleted ``dead_letter_ttl`` seconds after their last write. Pending rows
+    are flushed when the process exits.
+    """
+
+    def __init__(self, backend, batch_size=BQ_BATCH_SIZE, flush_interval=BQ_FLUSH_INTERVAL_SECONDS,
+                 max_retries=BQ_MAX_RETRIES, dead_letter_dir=BQ_DEAD_LETTER_DIR,
+                 dead_letter_ttl=BQ_DEAD_LETTER_TTL_SECONDS):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.dead_letter_dir = dead_letter_dir
+        self.dead_letter_ttl = dead_letter_ttl
+        self.purge_dead_letters()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="bq-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, table_id, row):
+        self._queue.put((table_id, (str(uuid.uuid4()), row)))
+
+    def close(self, timeout=30):
+        """Flush everything still buffered and stop the background thread."""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def _run(self):
+        buffers = {}
+        oldest = {}
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval / 2)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                for table_id in list(buffers):
+                    self._flush(table_id, buffers.pop(table_id))
+                return
+
+            if item is not None:
+                table_id, row = item
+                buffers.setdefault(table_id, []).append(row)
+                oldest.setdefault(table_id, time.monotonic())
+
+            now = time.monotonic()
+            for table_id in list(buffers):
+                if (len(buffers[table_id]) >= self.batch_size
+                        or now - oldest[table_id] >= self.flush_interval):
+                    del oldest[table_id]
+                    self._flush(table_id, buffers.pop(table_id))
+
+    def _flush(self, table_id, rows):
+        with span("bigquery.write_batch", table=table_id, rows=len(rows)) as current:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    self.backend.write(table_id, rows)
+                    current.set(attempts=attempt + 1)
+                    print(f"Data successfully inserted into table {table_id} ({len(rows)} rows).")
+                    return
+                except BigQueryWriteError as e:
+                    print(f"Attempt {attempt + 1} writing to {table_id} failed: {e}")
+                    if e.failed_indexes:
+                        rows = [rows[i] for i in e.failed_indexes if i < len(rows)]
+                except Exception as e:
+                    print(f"Attempt {attempt + 1} writing to {table_id} failed: {e}")
+                if attempt < self.max_retries:
+                    time.sleep(min(30, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.5))
+            current.set(attempts=self.max_retries + 1, dead_lettered=len(rows))
+            self._dead_letter(table_id, rows)
+
+    def _dead_letter(self, table_id, rows):
+        os.makedirs(self.dead_letter_dir, mode=0o700, exist_ok=True)
+        path = os.path.join(self.dead_letter_dir, f"{table_id}-{time.strftime('%Y%m%d')}.jsonl")
+        with open(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600), "a", encoding="utf-8") as f:
+            for row_id, row in rows:
+                f.write(json.dumps({"row_id": row_id, "row": row}) + "\n")
+        print(f"{len(rows)} rows for {table_id} written to {path}.")
+        self.purge_dead_letters()
+
+    def purge_dead_letters(self):
+        """Delete dead-letter files not written to for more than dead_letter_ttl seconds."""
+        if not os.path.isdir(self.dead_letter_dir):
+            return
+        cutoff = time.time() - self.dead_letter_ttl
+        for name in os.listdir(self.dead_letter_dir):
+            path = os.path.join(self.dead_letter_dir, name)
+            try:
+                if name.endswith(".jsonl") and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    print(f"Purged expired dead-letter file {path}.")
+            except OSError as e:
+                print(f"Could not purge dead-letter file {path}: {e}")
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Process-wide BigQueryWriter using the backend chosen by BQ_WRITE_BACKEND."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                if BQ_WRITE_BACKEND == "storage_write":
+                    backend = StorageWriteBackend()
+                else:
+                    from src.clients import get_bigquery_client
+                    backend = InsertAllBackend(get_bigquery_client())
+                _writer = BigQueryWriter(backend)
+    return _writer
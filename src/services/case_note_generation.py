@@ -1,38 +1,96 @@
+import json
 import os
+import re
+from typing import List
 
 from dotenv import load_dotenv
 from langchain.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.runnables import RunnableLambda
 from pydantic import Field, create_model
 
 load_dotenv()
 
-import vertexai
-from langchain_google_vertexai import (ChatVertexAI, HarmBlockThreshold,
-                                       HarmCategory)
+from src.cache import cached, cached_stream
+from src.clients import CHAT_MODEL_NAME, get_chat_model
+from src.rate_limit import estimate_tokens, get_limiter
 
-PROJECT_ID = os.getenv("PROJECT_ID")
-REGION = os.getenv("REGION")
+from .template_registry import CompiledTemplate, get_template_registry
+
+PROMPT_VERSION = "1"
+# transcripts above this many (estimated) tokens are summarised with map-reduce
+LONG_TRANSCRIPT_TOKENS = int(os.getenv("LONG_TRANSCRIPT_TOKENS", 12000))
+WINDOW_TOKENS = int(os.getenv("CASE_NOTES_WINDOW_TOKENS", 3000))
+WINDOW_OVERLAP_TOKENS = int(os.getenv("CASE_NOTES_WINDOW_OVERLAP_TOKENS", 300))
+MAP_CONCURRENCY = int(os.getenv("CASE_NOTES_MAP_CONCURRENCY", 8))
+
+
+def split_windows(transcript, window_tokens=WINDOW_TOKENS, overlap_tokens=WINDOW_OVERLAP_TOKENS):
+    """Split a transcript into token-bounded windows aligned to speaker turns.
+
+    Each window repeats the last turns of the previous one, up to
+    overlap_tokens, so facts spanning a boundary are not lost. Turns longer
+    than a window are split on sentence boundaries.
+    """
+    turns = []
+    for line in transcript.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if estimate_tokens(line) <= window_tokens:
+            turns.append(line)
+            continue
+        piece = ""
+        for sentence in re.split(r"(?<=[.!?])\s+", line):
+            if piece and estimate_tokens(piece + sentence) > window_tokens:
+                turns.append(piece)
+                piece = ""
+            piece = f"{piece} {sentence}".strip()
+        if piece:
+            turns.append(piece)
+
+    windows = []
+    current = []
+    current_tokens = 0
+    for turn in turns:
+        tokens = estimate_tokens(turn)
+        if current and current_tokens + tokens > window_tokens:
+            windows.append("\n".join(current))
+            overlap = []
+            overlap_size = 0
+            for previous in reversed(current):
+                overlap_size += estimate_tokens(previous)
+                if overlap_size > overlap_tokens:
+                    break
+                overlap.insert(0, previous)
+            current = overlap
+            current_tokens = sum(estimate_tokens(t) for t in current)
+        current.append(turn)
+        current_tokens += tokens
+    if current:
+        windows.append("\n".join(current))
+    return windows
 
-vertexai.init(project=PROJECT_ID, location=REGION)
 
 class CaseNotesGenerator:
 
     def __init__(self, transcript, template):
+        """template is a CompiledTemplate from the registry or a raw template dict."""
         self.transcript = transcript
-        self.template = template
+        if isinstance(template, CompiledTemplate):
+            self.compiled = template
+            self.template = template.data
+        else:
+            self.compiled = None
+            self.template = template
 
-    def create_dynamic_model(self):
-        fields = {
-            section: (str, Field(description=data['description']))
-            for section, data in self.template['sections'].items()
-        }
+    def get_compiled(self):
+        if self.compiled is None:
+            self.compiled = get_template_registry().compile(self.template)
+        return self.compiled
 
-        CaseNotesModel = create_model(
-            self.template['template_type'],
-            **fields
-        )
-        return CaseNotesModel
+    def create_dynamic_model(self):
+        return self.get_compiled().model
 
     def get_system_prompt(self):
         system_prompt = """You are an assistant for a mental health company. Your task is to review the audio transcription of a therapy session and generate case notes in first-person perspective, as if the therapist is personally writing them. Follow the specific template selected by the therapist for the session. Ensure the language used is professional, clear, and concise. Only include information explicitly mentioned in the audio, using direct quotes where appropriate to enhance accuracy. Avoid adding interpretations or assumptions beyond what was discussed in the session. Respond only with valid JSON. Do not write an introduction or summary.
@@ -58,25 +116,121 @@ class CaseNotesGenerator:
         ```"""
         return user_prompt
 
-    def get_notes(self):
-        model = ChatVertexAI(
-            model_name="gemini-1.5-pro",
-            convert_system_message_to_human=True,
-            safety_settings={
-                HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_LOW_AND_ABOVE
-            },
-        )
-        case_notes_parser = JsonOutputParser(
-            pydantic_object=self.create_dynamic_model())
-        format_instructions = case_notes_parser.get_format_instructions()
-
-        prompt = ChatPromptTemplate([("system", self.get_system_prompt()),
-                                     ("human", self.create_user_prompt())])
-        chain = prompt | model | case_notes_parser
-        input_dict = {
+    def create_facts_model(self):
+        fields = {
+            section: (List[str], Field(description=f"Facts relevant to: {data['description']}"))
+            for section, data in self.template['sections'].items()
+        }
+        return create_model(f"{self.template['template_type']}Facts", **fields)
+
+    def get_map_system_prompt(self):
+        return """You are an assistant for a mental health company. You will be given one part of the audio transcription of a therapy session. Extract the facts from this part that are relevant to each section of the case notes template, as short statements. Only include information explicitly mentioned, using direct quotes where appropriate. Avoid interpretations or assumptions. Use an empty list for sections with no relevant facts. Respond only with valid JSON. Do not write an introduction or summary."""
+
+    def create_map_user_prompt(self):
+        user_prompt = "Here is one part of the transcription of the therapy session: {transcript}\n"
+        user_prompt += f"Extract facts for the following {self.template['template_type']} sections:\n"
+        for section, data in self.template['sections'].items():
+            user_prompt += f"{section.capitalize()} - {data['description']}: \n\n"
+        user_prompt += """
+        ```
+        {format_instructions}
+        ```"""
+        return user_prompt
+
+    def create_reduce_user_prompt(self):
+        user_prompt = "Here are the facts extracted from consecutive parts of the therapy session, grouped by section: {facts}\n"
+        user_prompt += "Parts overlap, so merge repeated facts. "
+        user_prompt += f"Now, fill out the following {self.template['template_type']} notes:\n"
+        for section, data in self.template['sections'].items():
+            user_prompt += f"{section.capitalize()} - {data['description']}: \n\n"
+        user_prompt += "Respond only with valid JSON. Do not write an introduction or summary."
+        user_prompt += """
+        ```
+        {format_instructions}
+        ```"""
+        return user_prompt
+
+    def map_reduce_notes(self):
+        """Extract facts from transcript windows concurrently, then fill the template once."""
+        model = get_chat_model()
+        windows = split_windows(self.transcript)
+        print(f"Generating case notes from {len(windows)} transcript windows...")
+
+        facts_parser = JsonOutputParser(pydantic_object=self.create_facts_model())
+        map_prompt = ChatPromptTemplate([("system", self.get_map_system_prompt()),
+                                         ("human", self.create_map_user_prompt())])
+        map_chain = map_prompt | model | facts_parser
+        map_inputs = [
+            {"transcript": window, "format_instructions": facts_parser.get_format_instructions()}
+            for window in windows
+        ]
+        limiter = get_limiter("chat")
+        limited_map = RunnableLambda(lambda inputs: limiter.call(
+            lambda: map_chain.invoke(inputs), tokens=estimate_tokens(inputs["transcript"])))
+        extracted = limited_map.batch(map_inputs, config={"max_concurrency": MAP_CONCURRENCY})
+
+        facts = {section: [] for section in self.template['sections']}
+        for window_facts in extracted:
+            for section in facts:
+                for fact in window_facts.get(section) or []:
+                    if fact not in facts[section]:
+                        facts[section].append(fact)
+
+        notes_parser = self.get_compiled().parser
+        reduce_prompt = ChatPromptTemplate([("system", self.get_system_prompt()),
+                                            ("human", self.create_reduce_user_prompt())])
+        reduce_chain = reduce_prompt | model | notes_parser
+        facts_json = json.dumps(facts, indent=2)
+        return limiter.call(lambda: reduce_chain.invoke({
+            "facts": facts_json,
+            "format_instructions": notes_parser.get_format_instructions(),
+        }), tokens=estimate_tokens(facts_json))
+
+    def get_chain_input(self):
+        return {
             "transcript": self.transcript,
-            "format_instructions": format_instructions
+            "format_instructions": self.get_compiled().format_instructions
             }
-        response = chain.invoke(input_dict)
+
+    def stream_notes(self):
+        """Yield the case notes as a growing dict while the model generates them.
+
+        JsonOutputParser parses the incomplete JSON on every chunk, so each
+        yielded dict holds the sections seen so far, the last one possibly
+        cut mid-sentence. The final dict equals the get_notes() result. Long
+        transcripts go through map-reduce and are yielded once.
+        """
+        if estimate_tokens(self.transcript) > LONG_TRANSCRIPT_TOKENS:
+            yield self.get_notes()
+            return
+
+        compiled = self.get_compiled()
+        chain = compiled.prompt | get_chat_model() | compiled.parser
+        yield from cached_stream(
+            "case_notes", self.transcript,
+            lambda: get_limiter("chat").stream(lambda: chain.stream(self.get_chain_input()),
+                                               tokens=estimate_tokens(self.transcript)),
+            template=self.template, prompt_version=PROMPT_VERSION,
+            model_name=CHAT_MODEL_NAME)
+
+    def get_notes(self):
+        if estimate_tokens(self.transcript) > LONG_TRANSCRIPT_TOKENS:
+            return cached(
+                "case_notes_map_reduce", self.transcript, self.map_reduce_notes,
+                template=self.template, prompt_version=PROMPT_VERSION,
+                model_name=CHAT_MODEL_NAME,
+                generation_config={"window_tokens": WINDOW_TOKENS,
+                                   "overlap_tokens": WINDOW_OVERLAP_TOKENS})
+
+        model = get_chat_model()
+        compiled = self.get_compiled()
+        chain = compiled.prompt | model | compiled.parser
+        input_dict = self.get_chain_input()
+        response = cached(
+            "case_notes", self.transcript,
+            lambda: get_limiter("chat").call(lambda: chain.invoke(input_dict),
+                                             tokens=estimate_tokens(self.transcript)),
+            template=self.template, prompt_version=PROMPT_VERSION,
+            model_name=CHAT_MODEL_NAME)
 
         return response
@@ -0,0 +1,105 @@
+from typing import List, Literal
+
+from langchain.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import JsonOutputParser
+from pydantic import Field, create_model
+
+from src.cache import cached
+from src.clients import CHAT_MODEL_NAME
+from src.rate_limit import estimate_tokens, get_limiter
+from src.utils import load_model
+
+from .template_registry import CompiledTemplate
+from .progress_notes_inference import (CLIENT_PRESENTATION_OPTIONS,
+                                       CLIENT_STATUS_OPTIONS,
+                                       RESPONSE_TO_TREATMENT_OPTIONS,
+                                       RISK_ASSESSMENT_OPTIONS,
+                                       filter_progress_note)
+
+PROGRESS_NOTE_FIELDS = {
+    "client_presentation": ("Client's presentation", CLIENT_PRESENTATION_OPTIONS),
+    "response_to_treatment": ("Client's response to treatment", RESPONSE_TO_TREATMENT_OPTIONS),
+    "client_status": ("Client's Status", CLIENT_STATUS_OPTIONS),
+    "risk_assessment": ("Risk Assessment of client done by therapist", RISK_ASSESSMENT_OPTIONS),
+}
+
+PROMPT_VERSION = "1"
+
+
+class CombinedInference:
+    """Sends the transcript to the LLM once and produces every per-session output.
+
+    The single structured response covers the case-note template sections,
+    the four progress-note categories, a sentiment label and the question used
+    for resource retrieval. It is split back into the shapes returned by
+    CaseNotesGenerator, ProgressNotes, SentimentAnalysis and
+    ResourceRecommender.get_question.
+    """
+
+    def __init__(self, transcript, template):
+        self.transcript = transcript
+        self.template = template.data if isinstance(template, CompiledTemplate) else template
+
+    def create_dynamic_model(self):
+        fields = {
+            section: (str, Field(description=data['description']))
+            for section, data in self.template['sections'].items()
+        }
+        for name, (description, options) in PROGRESS_NOTE_FIELDS.items():
+            fields[name] = (List[Literal[tuple(options)]], Field(description=description))
+        fields["sentiment"] = (str, Field(
+            description="Single word describing the client's overall sentiment or emotion in the session"))
+        fields["resource_question"] = (str, Field(
+            description="First-person question about the most critical issue discussed, used to retrieve resources and worksheets"))
+
+        return create_model(f"{self.template['template_type']}Combined", **fields)
+
+    def get_system_prompt(self):
+        return """You are an assistant for a mental health company. You will review the audio transcription of a therapy session and complete several tasks in a single valid JSON response. Do not write an introduction or summary.
+        1. Case notes: fill out each template section in first-person perspective, as if the therapist is personally writing them. Use professional, clear and concise language. Only include information explicitly mentioned in the session, using direct quotes where appropriate.
+        2. Progress notes: for client_presentation, response_to_treatment, client_status and risk_assessment select zero or more items, only from the allowed options for that field.
+        3. Sentiment: classify the overall sentiment of the client in one word.
+        4. Resource question: formulate one question in first-person perspective about the most important issue discussed, to help retrieve an appropriate resource or worksheet.
+        """
+
+    def create_user_prompt(self):
+        user_prompt = "Here is the transcription of the therapy session: {transcript}\n"
+        user_prompt += f"The case notes must follow the {self.template['template_type']} template:\n"
+        for section, data in self.template['sections'].items():
+            user_prompt += f"{section.capitalize()} - {data['description']}: \n\n"
+        user_prompt += "Respond only with valid JSON. Do not write an introduction or summary."
+        user_prompt += """
+        ```
+        {format_instructions}
+        ```"""
+        return user_prompt
+
+    def run(self):
+        """Return (case_notes, progress_notes, sentiment, resource_question)."""
+        model = load_model()
+        parser = JsonOutputParser(pydantic_object=self.create_dynamic_model())
+        prompt = ChatPromptTemplate([("system", self.get_system_prompt()),
+                                     ("human", self.create_user_prompt())])
+        chain = prompt | model | parser
+        input_dict = {
+            "transcript": self.transcript,
+            "format_instructions": parser.get_format_instructions(),
+        }
+        response = cached(
+            "combined", self.transcript,
+            lambda: get_limiter("chat").call(lambda: chain.invoke(input_dict),
+                                             tokens=estimate_tokens(self.transcript)),
+            template=self.template, prompt_version=PROMPT_VERSION,
+            model_name=CHAT_MODEL_NAME)
+        return self.split_response(response)
+
+    def split_response(self, response):
+        """Split the combined response back into the existing result shapes."""
+        case_notes = {
+            section: response.get(section, "")
+            for section in self.template['sections']
+        }
+        progress_notes = {"progress_notes": [filter_progress_note(response)]}
+        sentiment = response.get("sentiment")
+        resource_question = (response.get("resource_question") or "").strip() or None
+        return case_notes, progress_notes, sentiment, resource_question
@@ -2,15 +2,62 @@ import datetime
 import os
 
 from dotenv import load_dotenv
-from google.cloud import bigquery
+
+from src.clients import get_bigquery_client
+from src.tracing import span
+
+from .bq_writer import get_writer
 
 load_dotenv()
 
+# queue inserts on the background writer instead of blocking the caller
+BQ_WRITE_BEHIND = os.getenv("BQ_WRITE_BEHIND", "true").lower() == "true"
+
+def progress_note_columns(progress_note):
+    """Lower-cased, comma-separated labels of one progress note, in insert_progress_notes column order."""
+    return tuple(
+        ', '.join([item.lower() for item in progress_note[field]])
+        for field in ('client_presentation', 'response_to_treatment', 'client_status', 'risk_assessment')
+    )
+
 class BigQueryConnector:
-    def __init__(self):
-        self.client = bigquery.Client()
+    def __init__(self, write_behind=BQ_WRITE_BEHIND, raise_on_error=False):
+        # raise_on_error makes rejected synchronous inserts raise instead of only being logged
+        self.raise_on_error = raise_on_error
+        self._client = None
         self.project_id = os.getenv("PROJECT_ID")
         self.dataset_name = "case_crafter_db"
+        self.writer = get_writer() if write_behind else None
+
+    @property
+    def client(self):
+        # created on first use so constructing the connector does no network work
+        if self._client is None:
+            self._client = get_bigquery_client()
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    def _insert_rows(self, table_id, rows_to_insert):
+        with span("bigquery.insert", table=table_id, rows=len(rows_to_insert),
+                  write_behind=self.writer is not None):
+            if self.writer is not None:
+                for row in rows_to_insert:
+                    self.writer.write(table_id, row)
+                return
+
+            try:
+                errors = self.client.insert_rows_json(table_id, rows_to_insert)
+                if errors == []:
+                    print(f"Data successfully inserted into table {table_id}.")
+                else:
+                    print(f"Failed to insert rows: {errors}")
+            except Exception as e:
+                raise Exception(f"Error inserting data into BigQuery: {e}")
+            if errors and self.raise_on_error:
+                raise Exception(f"BigQuery rejected rows for {table_id}: {errors}")
 
     def insert_case_notes(
             self, session_id, client_id, client_name, therapist_id, llm_case_notes):
@@ -28,14 +75,7 @@ class BigQueryConnector:
             }
         ]
         
-        try:
-            errors = self.client.insert_rows_json(table_id, rows_to_insert)
-            if errors == []:
-                print(f"Data successfully inserted into table {table_name}.")
-            else:
-                print(f"Failed to insert rows: {errors}")
-        except Exception as e:
-            raise Exception(f"Error inserting data into BigQuery: {e}")
+        self._insert_rows(table_id, rows_to_insert)
         
     def insert_progress_notes(
             self, session_id, client_id, client_name, therapist_id,
@@ -59,14 +99,7 @@ class BigQueryConnector:
             }
         ]
 
-        try:
-            errors = self.client.insert_rows_json(table_id, rows_to_insert)
-            if errors == []:
-                print(f"Data successfully inserted into table {table_name}.")
-            else:
-                print(f"Failed to insert rows: {errors}")
-        except Exception as e:
-            raise Exception(f"Error inserting data into BigQuery: {e}")
+        self._insert_rows(table_id, rows_to_insert)
         
     def insert_feedback(self, session_id, feedback):
         table_name = "feedback"
@@ -80,20 +113,15 @@ class BigQueryConnector:
             }
         ]
 
-        try:
-            errors = self.client.insert_rows_json(table_id, rows_to_insert)
-            if errors == []:
-                print(f"Feedback successfully inserted into table {table_name}.")
-            else:
-                print(f"Failed to insert rows: {errors}")
-        except Exception as e:
-            raise Exception(f"Error inserting feedback into BigQuery: {e}")
+        self._insert_rows(table_id, rows_to_insert)
 
     def close_connection(self):
         self.client = None
         print("BigQuery connection closed.")
 
     def setup_tables(self):
+        from google.cloud import bigquery
+
         schemas = {
             "case-notes": [
                 bigquery.SchemaField("session_id", "STRING", mode="REQUIRED"),
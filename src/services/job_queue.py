@@ -0,0 +1,292 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+from src.tracing import span, trace_session
+
+load_dotenv()
+
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", ".cache/jobs.sqlite3")
+# sessions processed at once by this instance; each one also fans out its LLM stages
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+# idle workers re-check the table this often, which also picks up jobs from other processes
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", 1.0))
+# partial results are written at most this often while a stage is running
+JOB_PROGRESS_SECONDS = 0.5
+# a running job whose lease is not renewed for this long is taken to be orphaned
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", 60))
+# finished jobs hold transcripts and notes, so they are deleted this long after they end
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", 24 * 60 * 60))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class JobQueue:
+    """Persistent queue of jobs run by a bounded pool of worker threads.
+
+    Jobs live in a SQLite table, so queued work survives a browser refresh or
+    a restart, and several processes can share it. A claimed job is leased
+    to this queue's worker id, and a heartbeat thread renews the lease while
+    it runs. A running job whose lease expired belongs to a process that
+    died, so it is claimed again; jobs other live processes are running are
+    left alone. A worker claims the oldest claimable job of the owner with
+    the fewest jobs running, so one therapist's backlog cannot starve the
+    others. ``handler(payload, progress)`` does the work. It reports its
+    stage and partial results through ``progress(stage, **partial)`` and
+    returns the final result dict. Done and failed jobs are purged
+    ``retention`` seconds after they finish.
+    """
+
+    def __init__(self, handler, path=JOB_DB_PATH, max_workers=JOB_WORKERS,
+                 retention=JOB_RETENTION_SECONDS):
+        self.handler = handler
+        self.path = path
+        self.retention = retention
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wakeup = threading.Condition()
+        self._stopped = False
+        self._running = set()
+        self._running_lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, owner TEXT, status TEXT NOT NULL, stage TEXT, "
+                "payload TEXT NOT NULL, result TEXT NOT NULL, error TEXT, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL, "
+                "worker TEXT, lease_until REAL)"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, kind in (("worker", "TEXT"), ("lease_until", "REAL")):
+                if column not in columns:
+                    # tables created before leases; their running jobs count as expired
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self.purge()
+
+        threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True).start()
+        self._workers = [
+            threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            for i in range(max_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def submit(self, payload, owner=None):
+        """Queue a job and return its id."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, owner, status, stage, payload, result, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, owner, QUEUED, QUEUED, json.dumps(payload), "{}", now, now),
+            )
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id):
+        """Owner, payload, status, stage, partial or final result and error of a job, or None."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, owner, payload, status, stage, result, error, created_at, updated_at "
+                "FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ("id", "owner", "payload", "status", "stage", "result", "error", "created_at", "updated_at")
+        job = dict(zip(keys, row))
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"])
+        return job
+
+    def purge(self):
+        """Delete done and failed jobs that finished more than retention seconds ago."""
+        with self._connect() as conn:
+            purged = conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (DONE, FAILED, time.time() - self.retention),
+            ).rowcount
+        if purged:
+            print(f"Purged {purged} finished jobs.")
+
+    def _claim(self):
+        """Lease the next fairly chosen claimable job to this queue and return (id, payload).
+
+        Claimable jobs are queued ones and running ones whose lease expired.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id, payload, status FROM jobs AS claimable "
+                "WHERE status = ? OR (status = ? AND COALESCE(lease_until, 0) < ?) ORDER BY "
+                "(SELECT COUNT(*) FROM jobs AS running WHERE running.status = ? "
+                "AND running.lease_until >= ? AND running.owner IS claimable.owner), created_at LIMIT 1",
+                (QUEUED, RUNNING, now, RUNNING, now),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, stage = ?, worker = ?, lease_until = ?, updated_at = ? "
+                    "WHERE id = ?",
+                    (RUNNING, "started", self.worker_id, now + JOB_LEASE_SECONDS, now, row[0]))
+        if row is None:
+            return None
+        if row[2] == RUNNING:
+            print(f"Reclaimed job {row[0]} after its lease expired.")
+        return row[:2]
+
+    def _heartbeat(self):
+        """Renew the leases of the jobs this queue is running, including after stop(), and purge old jobs."""
+        while not self._stopped or self._running:
+            time.sleep(JOB_LEASE_SECONDS / 3)
+            with self._running_lock:
+                job_ids = list(self._running)
+            try:
+                if job_ids:
+                    with self._connect() as conn:
+                        conn.executemany(
+                            "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = ?",
+                            [(time.time() + JOB_LEASE_SECONDS, job_id, self.worker_id, RUNNING)
+                             for job_id in job_ids])
+                self.purge()
+            except sqlite3.Error as e:
+                print(f"Could not renew job leases: {e}")
+
+    def _update(self, job_id, stage=None, partial=None, status=None, result=None, error=None):
+        with self._connect() as conn:
+            if partial:
+                current = json.loads(conn.execute(
+                    "SELECT result FROM jobs WHERE id = ?", (job_id,)).fetchone()[0])
+                current.update(partial)
+                result = current
+            # only the current lease holder may write, in case the job was reclaimed meanwhile
+            updated = conn.execute(
+                "UPDATE jobs SET stage = COALESCE(?, stage), status = COALESCE(?, status), "
+                "result = COALESCE(?, result), error = ?, updated_at = ? WHERE id = ? AND worker = ?",
+                (stage, status, None if result is None else json.dumps(result, default=str),
+                 error, time.time(), job_id, self.worker_id),
+            ).rowcount
+        if not updated:
+            print(f"Job {job_id} is no longer leased to this worker; update dropped.")
+
+    def _reporter(self, job_id):
+        last = {"stage": None, "written_at": 0.0}
+
+        def progress(stage, **partial):
+            # stage changes are always written, partial results at most every JOB_PROGRESS_SECONDS
+            now = time.time()
+            if stage == last["stage"] and now - last["written_at"] < JOB_PROGRESS_SECONDS:
+                return
+            self._update(job_id, stage=stage, partial=partial)
+            last["stage"], last["written_at"] = stage, now
+
+        return progress
+
+    def _run(self, job_id, payload):
+        start = time.perf_counter()
+        with self._running_lock:
+            self._running.add(job_id)
+        try:
+            result = self.handler(json.loads(payload), self._reporter(job_id))
+            self._update(job_id, stage=DONE, status=DONE, partial=result)
+            print(f"Job {job_id} finished in {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            print(f"Job {job_id} failed:\n{traceback.format_exc()}")
+            self._update(job_id, stage=FAILED, status=FAILED, error=str(e))
+        finally:
+            with self._running_lock:
+                self._running.discard(job_id)
+
+    def _work(self):
+        while not self._stopped:
+            job = self._claim()
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(timeout=JOB_POLL_SECONDS)
+                continue
+            self._run(*job)
+
+    def stop(self):
+        """Let the workers exit after their current job; queued jobs stay in the table."""
+        self._stopped = True
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+
+def run_session_job(payload, progress):
+    """Transcribe one uploaded recording, generate every output and store it in BigQuery."""
+    with trace_session(payload["session_id"]), span("session", source="job"):
+        return _run_session_job(payload, progress)
+
+
+def _run_session_job(payload, progress):
+    from .db_handler import BigQueryConnector, progress_note_columns
+    from .session_pipeline import SessionPipeline
+    from .speech_inference import SpeechToText
+    from .template_registry import get_template_registry
+
+    progress("transcribing")
+    speech_to_text = SpeechToText(payload["audio_uri"], session_id=payload["session_id"])
+    transcript = speech_to_text.transcribe(streaming=payload.get("streaming_stt", False))
+    progress("generating", transcript=transcript)
+
+    template = get_template_registry().get(payload["template"])
+    pipeline = SessionPipeline(transcript, template, combined=payload.get("combined", False))
+    pipeline_result = pipeline.run_streaming(
+        lambda partial_notes: progress("generating", case_notes=partial_notes))
+    if pipeline_result.case_notes is None:
+        raise RuntimeError(f"Case notes could not be generated: {pipeline_result.case_notes_error()}")
+
+    result = {
+        "transcript": transcript,
+        "case_notes": pipeline_result.case_notes,
+        "progress_notes": pipeline_result.progress_notes,
+        "sentiment": pipeline_result.sentiment,
+        "resource_links": pipeline_result.resource_links,
+        "timings": pipeline_result.timings,
+        "errors": {stage: str(error) for stage, error in pipeline_result.errors.items()},
+    }
+    progress("saving", **result)
+
+    db_connector = BigQueryConnector()
+    db_connector.insert_case_notes(payload["session_id"], payload["client_id"], payload["client_name"],
+                                   payload["therapist_id"], str(pipeline_result.case_notes))
+    if pipeline_result.progress_notes is not None and pipeline_result.sentiment is not None:
+        db_connector.insert_progress_notes(
+            payload["session_id"], payload["client_id"], payload["client_name"], payload["therapist_id"],
+            *progress_note_columns(pipeline_result.progress_notes['progress_notes'][0]),
+            pipeline_result.sentiment)
+    return result
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Process-wide JobQueue for session jobs; its workers start on first use."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue(run_session_job)
+    return _queue
@@ -1,11 +1,74 @@
+import os
 from typing import List
 
 from langchain_core.messages import AIMessage
 from langchain_core.output_parsers import JsonOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
+from src.cache import cached
+from src.clients import CHAT_MODEL_NAME
+from src.rate_limit import estimate_tokens, get_limiter
 from src.utils import load_model
 
+PROMPT_VERSION = "2"
+# pass an enum response schema so the model can only emit valid labels
+CONSTRAINED_PROGRESS_NOTES = os.getenv("CONSTRAINED_PROGRESS_NOTES", "true").lower() == "true"
+
+CLIENT_PRESENTATION_OPTIONS = ['Anxious', 'Confused', 'Energetic', 'Worried', 'Fearful',
+                               'Cooperative', 'Withdrawn', 'Lethargic', 'Relaxed', 'Depressed']
+
+RESPONSE_TO_TREATMENT_OPTIONS = ['Cooperative', 'Uninterested', 'Receptive',
+                                 'Combative', 'Engaged']
+
+CLIENT_STATUS_OPTIONS = ['Improving', 'Unchanged', 'Regressed', 'Deteriorating']
+
+RISK_ASSESSMENT_OPTIONS = ['Attempted to Cause Harm', 'Intention to cause harm',
+                           'Suicidal ideation', 'Danger to self', 'Danger to others',
+                           'Plan to cause harm']
+
+PROGRESS_NOTE_OPTIONS = {
+    'client_presentation': CLIENT_PRESENTATION_OPTIONS,
+    'response_to_treatment': RESPONSE_TO_TREATMENT_OPTIONS,
+    'client_status': CLIENT_STATUS_OPTIONS,
+    'risk_assessment': RISK_ASSESSMENT_OPTIONS,
+}
+
+# built once so validating a label is a set lookup
+VALID_PROGRESS_NOTE_OPTIONS = {
+    field: frozenset(options) for field, options in PROGRESS_NOTE_OPTIONS.items()
+}
+
+# Vertex AI response schema: every category is an array of enum strings
+RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "progress_notes": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    field: {"type": "ARRAY", "items": {"type": "STRING", "enum": options}}
+                    for field, options in PROGRESS_NOTE_OPTIONS.items()
+                },
+                "required": list(PROGRESS_NOTE_OPTIONS),
+            },
+        },
+    },
+    "required": ["progress_notes"],
+}
+
+
+def filter_progress_note(note):
+    """Return a copy of one progress note holding only valid labels for each category."""
+    filtered = {}
+    for field, valid in VALID_PROGRESS_NOTE_OPTIONS.items():
+        items = note.get(field) or []
+        if isinstance(items, str):
+            items = [items]
+        filtered[field] = [item for item in items if item in valid]
+    return filtered
+
+
 class Notes(BaseModel):
 
     client_presentation: List = Field(description="Client's presentation")
@@ -21,51 +84,41 @@ output_parser = JsonOutputParser(pydantic_object=ProgressNotesJSON)
 format_instructions = output_parser.get_format_instructions()
 
 class ProgressNotes:
-    def __init__(self, transcript):
+    def __init__(self, transcript, constrained=CONSTRAINED_PROGRESS_NOTES):
         self.model = load_model()
         self.transcript = transcript
+        self.constrained = constrained
 
     def guardrail_check(self, json_response):
-        valid_client_presentation = ['Anxious', 'Confused', 'Energetic', 'Worried', 'Fearful', 
-                                    'Cooperative', 'Withdrawn', 'Lethargic', 'Relaxed', 'Depressed']
-
-        valid_response_to_treatment = ['Cooperative', 'Uninterested', 'Receptive', 
-                                    'Combative', 'Engaged']
-
-        valid_client_status = ['Improving', 'Unchanged', 'Regressed', 'Deteriorating']
-
-        valid_risk_assessment = ['Attempted to Cause Harm', 'Intention to cause harm', 
-                                'Suicidal ideation', 'Danger to self', 'Danger to others', 
-                                'Plan to cause harm']
-
-        # Example JSON data
-        data = {
-            'progress_notes': [
-                {
-                    'client_presentation': ['Anxious', 'Worried', 'Frustrated'],
-                    'response_to_treatment': ['Engaged', 'Receptive'],
-                    'client_status': ['Improving'],
-                    'risk_assessment': ['']
-                }
-            ]
-        }
-
-        # Function to filter each list based on the specific valid values
-        def filter_progress_notes(data):
-            for note in data['progress_notes']:
-                note['client_presentation'] = [item for item in note['client_presentation'] if item in valid_client_presentation]
-                note['response_to_treatment'] = [item for item in note['response_to_treatment'] if item in valid_response_to_treatment]
-                note['client_status'] = [item for item in note['client_status'] if item in valid_client_status]
-                note['risk_assessment'] = [item for item in note['risk_assessment'] if item in valid_risk_assessment]
-            return data
-
-        # Filter the data
-        filtered_data = filter_progress_notes(data)
-        return filtered_data
-
-
+        """Drop any label that is not in the options list, without mutating json_response."""
+        notes = (json_response or {}).get('progress_notes') or [{}]
+        return {'progress_notes': [filter_progress_note(note) for note in notes]}
+
+    def get_constrained_prompt(self):
+        template = """Classify the following transcript of a therapy session into four categories: Client Presentation (the client's emotional state), Response to Treatment, Client Status, and Risk Assessment. For each category select every option that is supported by the transcript, or none.
+
+        Transcript:
+        {transcript}"""
+        system_prompt = "You are a mental health assistant designed to analyze and categorize a client's sentiment, mood, and progress based on a transcript of conversations between the therapist and the patient."
+        return ChatPromptTemplate.from_messages([("system", system_prompt), ("human", template)])
+
+    def run_constrained_progress_notes(self):
+        """Classify with a response schema, so the options are enforced by the model instead of the prompt."""
+        model = self.model.bind(response_mime_type="application/json", response_schema=RESPONSE_SCHEMA)
+        chain = self.get_constrained_prompt() | model | JsonOutputParser()
+        response = cached(
+            "progress_notes", self.transcript,
+            lambda: get_limiter("chat").call(lambda: chain.invoke({"transcript": self.transcript}),
+                                             tokens=estimate_tokens(self.transcript)),
+            prompt_version=PROMPT_VERSION, model_name=CHAT_MODEL_NAME,
+            generation_config={"response_schema": RESPONSE_SCHEMA})
+        print('Response: ', response)
+        return self.guardrail_check(response)
 
     def run_progress_notes(self):
+        if self.constrained:
+            return self.run_constrained_progress_notes()
+
         template = f"""You will be provided with a transcript. Your task is to classify the transcript based on four main categories: Client Presentation, Response to Treatment, Client Status, and Risk Assessment.
         You are a mental health assistant designed to analyze and categorize a client's sentiment, mood, and progress based on a transcript of conversations between the therapist and the patient. You must answer in a valid JSON format.
 
@@ -97,7 +150,11 @@ class ProgressNotes:
         prompt = ChatPromptTemplate.from_messages([("system", system_prompt), ("human", template)])
         chain = prompt | self.model | output_parser
         input_dict = {"transcript": self.transcript, "format_instructions": format_instructions}
-        response = chain.invoke(input_dict)
+        response = cached(
+            "progress_notes", self.transcript,
+            lambda: get_limiter("chat").call(lambda: chain.invoke(input_dict),
+                                             tokens=estimate_tokens(self.transcript)),
+            prompt_version=PROMPT_VERSION, model_name=CHAT_MODEL_NAME)
         print('Response: ', response)
         response = self.guardrail_check(response)
         return response
\ No newline at end of file
@@ -1,20 +1,36 @@
 import os
+import re
+import statistics
+import time
 
 from dotenv import load_dotenv
 from langchain.prompts import ChatPromptTemplate
-from langchain_google_vertexai import (ChatVertexAI, HarmBlockThreshold,
-                                       HarmCategory, VertexAIEmbeddings)
 
-from ..deployment.vector_search import VectorSearch
+from src.cache import cached
+from src.clients import CHAT_MODEL_NAME, get_chat_model, get_vector_search
+from src.rate_limit import estimate_tokens, get_limiter
+
 from .retriever import Retriever
 
 load_dotenv()
 
+PROMPT_VERSION = "1"
+# "question" asks the LLM for a search question; "embedding" searches with the
+# client's own turns and skips the generative call
+RECOMMENDATION_MODE = os.getenv("RECOMMENDATION_MODE", "question")
+SEGMENT_CHARS = 500
+MAX_SEGMENTS = 16
+# ranks per segment considered by reciprocal-rank fusion, and its damping constant
+FUSION_DEPTH = 10
+RRF_K = 60
+SPEAKER_LINE = re.compile(r"^Speaker (\d+):\s*(.*)$")
+
 class ResourceRecommender:
     """A class for recommending resources based on therapy session transcripts."""
 
-    def __init__(self, transcript):
+    def __init__(self, transcript, mode=RECOMMENDATION_MODE):
         self.transcript = transcript
+        self.mode = mode
         self.vector_search = None
 
     def get_system_prompt(self):
@@ -30,13 +46,7 @@ class ResourceRecommender:
 
     def get_question(self):
         """Generate the main question from the transcript."""
-        model = ChatVertexAI(
-            model_name="gemini-1.5-pro",
-            convert_system_message_to_human=True,
-            safety_settings={
-                HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_LOW_AND_ABOVE,
-            },
-        )
+        model = get_chat_model()
 
         prompt = ChatPromptTemplate.from_messages([
             ("system", self.get_system_prompt()),
@@ -47,36 +57,128 @@ class ResourceRecommender:
         input_dict = {
             "transcript": self.transcript,
         }
-        response = chain.invoke(input_dict)
+        question = cached(
+            "resource_question", self.transcript,
+            lambda: get_limiter("chat").call(lambda: chain.invoke(input_dict),
+                                             tokens=estimate_tokens(self.transcript)).content.strip(),
+            prompt_version=PROMPT_VERSION, model_name=CHAT_MODEL_NAME)
 
-        print("Generated Question:", response.content)
-        return response.content.strip()
+        print("Generated Question:", question)
+        return question
 
     def initialize_vector_search(self):
-        """Initialize the vector search with required configurations."""
-        INDEX_ID = os.getenv("INDEX_ID")
-        ENDPOINT_ID = os.getenv("ENDPOINT_ID")
-        EMBEDDING_MODEL = VertexAIEmbeddings(model_name="text-embedding-005")
-
-        self.vector_search = VectorSearch(
-            index_id=INDEX_ID,
-            endpoint_id=ENDPOINT_ID,
-            embedding_model=EMBEDDING_MODEL,
-        )
+        """Attach the process-wide vector search shared by all recommenders."""
+        self.vector_search = get_vector_search()
 
-    def get_recommendations(self):
-        """Retrieve resource recommendations based on the generated question."""
-        question = self.get_question()
+    def get_client_segments(self):
+        """Split the transcript into client-turn segments of about SEGMENT_CHARS.
 
+        The client is taken to be the speaker with the most words. Transcripts
+        without speaker labels are split as a whole. Only the MAX_SEGMENTS
+        longest segments are kept.
+        """
+        turns = {}
+        for line in self.transcript.splitlines():
+            match = SPEAKER_LINE.match(line.strip())
+            if match:
+                turns.setdefault(match.group(1), []).append(match.group(2))
+        if turns:
+            client = max(turns, key=lambda speaker: sum(len(t.split()) for t in turns[speaker]))
+            texts = turns[client]
+        else:
+            texts = [self.transcript]
+
+        segments = []
+        current = ""
+        for text in texts:
+            for sentence in re.split(r"(?<=[.!?])\s+", text):
+                if current and len(current) + len(sentence) > SEGMENT_CHARS:
+                    segments.append(current)
+                    current = ""
+                current = f"{current} {sentence}".strip()
+        if current:
+            segments.append(current)
+
+        return sorted(segments, key=len, reverse=True)[:MAX_SEGMENTS]
+
+    def get_retriever(self):
         if self.vector_search is None:
             self.initialize_vector_search()
+        return Retriever(self.vector_search.vector_store, index_version=self.vector_search.index_version)
 
-        retriever = Retriever(self.vector_search.vector_store)
-        documents = retriever.retrieve(query=question, top_k=3)
-        resource_links = set()
+    def get_links(self, documents, top_k=3):
+        resource_links = []
         for document in documents:
             resource_link = document.metadata.get("link")
-            if resource_link:
-                resource_links.add(resource_link)
-
+            if resource_link and resource_link not in resource_links:
+                resource_links.append(resource_link)
+            if len(resource_links) == top_k:
+                break
         return resource_links
+
+    def get_recommendations_by_embedding(self, top_k=3):
+        """Recommend resources from client-turn embeddings, without a generative call.
+
+        All segments are embedded in one batch and searched, and the ranked
+        resources of every segment are combined with reciprocal-rank fusion.
+        """
+        segments = self.get_client_segments()
+        if not segments:
+            return []
+        results = self.get_retriever().retrieve_many(segments, top_k=FUSION_DEPTH)
+
+        scores = {}
+        documents = {}
+        for ranked in results:
+            for rank, document in enumerate(ranked):
+                key = document.metadata.get("file_name") or document.metadata.get("link")
+                scores[key] = scores.get(key, 0.0) + 1.0 / (RRF_K + rank + 1)
+                documents.setdefault(key, document)
+        fused = sorted(scores, key=scores.get, reverse=True)
+        return self.get_links([documents[key] for key in fused], top_k)
+
+    def get_recommendations(self, question=None):
+        """Retrieve resource recommendations based on the generated question.
+
+        A precomputed question (e.g. from the combined multi-task call) skips
+        the question-generation LLM call. In "embedding" mode no question is
+        generated at all.
+        """
+        if question is None and self.mode == "embedding":
+            return self.get_recommendations_by_embedding()
+        if question is None:
+            question = self.get_question()
+
+        documents = self.get_retriever().retrieve(query=question, top_k=3)
+        return self.get_links(documents)
+
+
+def compare_latency(transcript, runs=3):
+    """Time the question and embedding modes on a transcript and print the medians.
+
+    Each run's transcript gets a unique suffix so the question is regenerated
+    every time. Segment embeddings and retrieval results may be served from
+    their caches after the first run, as they would be in production, so run 0
+    shows the cold embedding-mode latency.
+    """
+    timings = {"question": [], "embedding": []}
+    for run in range(runs):
+        for mode in timings:
+            recommender = ResourceRecommender(f"{transcript}\n[run {run} {mode}]", mode=mode)
+            start = time.perf_counter()
+            links = recommender.get_recommendations()
+            timings[mode].append(time.perf_counter() - start)
+            print(f"[{mode}] run {run}: {timings[mode][-1]:.2f}s {links}")
+    for mode, values in timings.items():
+        print(f"{mode}: median {statistics.median(values):.2f}s over {runs} runs")
+    return timings
+
+
+if __name__ == "__main__":
+    # python -m src.services.resource_recommendation [transcript.txt]
+    import sys
+
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        os.path.dirname(__file__), "..", "dependencies", "sample_transcript_8mins.txt")
+    with open(path, "r", encoding="utf-8") as f:
+        compare_latency(f.read())
@@ -1,12 +1,103 @@
+import threading
+from collections import OrderedDict
+
+from src.deployment.embedding_store import embed_queries
+from src.tracing import span, traced
+
+# how many chunks to fetch per requested resource before collapsing by file
+OVERFETCH_FACTOR = 4
+CACHE_SIZE = 256
+
+
+class LRUCache:
+    """Small thread-safe LRU mapping shared by every Retriever."""
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+_embedding_cache = LRUCache()
+_result_cache = LRUCache()
+
+
+def distinct_by_file(documents, k):
+    """Keep the best-ranked chunk of each resource file, up to k resources."""
+    seen = set()
+    distinct = []
+    for document in documents:
+        key = document.metadata.get("file_name") or document.metadata.get("link") or document.page_content
+        if key in seen:
+            continue
+        seen.add(key)
+        distinct.append(document)
+        if len(distinct) == k:
+            break
+    return distinct
+
+
 class Retriever:
-    """Retriever class to handle vector search queries."""
+    """Retriever class to handle vector search queries.
+
+    Search results are cached under ``index_version()``, so a rebuilt index
+    is never answered from the cache of the previous one. Without a version,
+    results are not cached.
+    """
+
+    def __init__(self, vector_store, index_version=None):
+        self.vector_store = vector_store
+        self.index_version = index_version or (lambda: getattr(vector_store, "version", None))
+
+    def embed(self, queries):
+        """Embed queries, sending only the ones not in the LRU cache in one batch."""
+        embeddings = self.vector_store.embeddings
+        model_name = getattr(embeddings, "model_name", None) or type(embeddings).__name__
+        missing = [q for q in dict.fromkeys(queries) if _embedding_cache.get((model_name, q)) is None]
+        if missing:
+            for query, embedding in zip(missing, embed_queries(embeddings, missing)):
+                _embedding_cache.set((model_name, query), embedding)
+        return [_embedding_cache.get((model_name, q)) for q in queries]
+
+    @traced("vector_search")
+    def search(self, embedding, fetch_k):
+        """Ranked chunks for one query embedding, as (document, score) pairs."""
+        return self.vector_store.similarity_search_by_vector_with_score(embedding, k=fetch_k)
 
-    def __init__(self, vector_store):
-        self.retriever = vector_store.as_retriever()
+    def retrieve_many(self, queries, top_k=3):
+        """Return up to top_k distinct resources for each query, best first."""
+        with span("retrieval", queries=len(queries), top_k=top_k) as current:
+            version = self.index_version()
+            store_key = (type(self.vector_store).__name__, version)
+            results = [_result_cache.get((store_key, q, top_k)) if version is not None else None
+                       for q in queries]
+            pending = [i for i, result in enumerate(results) if result is None]
+            current.set(cache_hits=len(queries) - len(pending))
+            if pending:
+                print(f"Retrieving top {top_k} results for {len(pending)} queries")
+                embeddings = self.embed([queries[i] for i in pending])
+                for i, embedding in zip(pending, embeddings):
+                    scored = self.search(embedding, fetch_k=top_k * OVERFETCH_FACTOR)
+                    results[i] = distinct_by_file([document for document, _ in scored], top_k)
+                    if version is not None:
+                        _result_cache.set((store_key, queries[i], top_k), results[i])
+                print("Results retrieved.")
+            return results
 
     def retrieve(self, query, top_k=3):
-        """Retrieve the top-k results for the given query."""
-        print(f"Retrieving top {top_k} results for query: {query}")
-        results = self.retriever.invoke(query, top_k=top_k)
-        print("Results retrieved.")
-        return results
\ No newline at end of file
+        """Retrieve the top-k distinct resources for the given query."""
+        return self.retrieve_many([query], top_k=top_k)[0]
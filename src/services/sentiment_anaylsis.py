@@ -1,30 +1,22 @@
 
-import json
-import os
+from dotenv import load_dotenv
 
-import vertexai
-import vertexai.preview.generative_models as generative_models
-from dotenv import dotenv_values, load_dotenv
-from google.oauth2 import service_account
-from vertexai.generative_models import GenerativeModel, Part
+from src.cache import cached
+from src.clients import SENTIMENT_ENDPOINT, get_generative_model
+from src.rate_limit import get_limiter
+from src.tracing import add_tokens
 
 load_dotenv()
 
-GOOGLE_API_KEY = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
-PROJECT_ID = os.getenv("PROJECT_ID")
-REGION = os.getenv("REGION")
-
-with open(GOOGLE_API_KEY) as source:
-    info = json.load(source)
-
-vertex_credentials = service_account.Credentials.from_service_account_info(info)
-vertexai.init(project=PROJECT_ID, location=REGION)
+PROMPT_VERSION = "1"
 
 class SentimentAnalysis:
     def __init__(self, transcript):
         self.transcript = transcript
 
     def run_sentiment(self):
+        import vertexai.preview.generative_models as generative_models
+
         generation_config = {
         "max_output_tokens": 2048,
         "temperature": .1,
@@ -36,16 +28,22 @@ class SentimentAnalysis:
         generative_models.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
         generative_models.HarmCategory.HARM_CATEGORY_HARASSMENT: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
     }  
-        model = GenerativeModel(
-        "projects/738905644646/locations/asia-southeast1/endpoints/6471483548531425280",
-        system_instruction=["""You are a model able to classify a text"""]
-    )
-        chat = model.start_chat()
-        response = chat.send_message(
-        [self.transcript],
-        generation_config=generation_config,
-        safety_settings=safety_settings
-    )
-        sentiment = response.candidates[0].content.parts[0].text
+        model = get_generative_model()
+
+        def classify():
+            chat = model.start_chat()
+            response = get_limiter("sentiment").call(lambda: chat.send_message(
+                [self.transcript],
+                generation_config=generation_config,
+                safety_settings=safety_settings
+            ))
+            usage = getattr(response, "usage_metadata", None)
+            if usage is not None:
+                add_tokens(usage.prompt_token_count, usage.candidates_token_count)
+            return response.candidates[0].content.parts[0].text
+
+        sentiment = cached(
+            "sentiment", self.transcript, classify, prompt_version=PROMPT_VERSION,
+            model_name=SENTIMENT_ENDPOINT, generation_config=generation_config)
         return sentiment
 
@@ -0,0 +1,160 @@
+import contextvars
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from src.tracing import span
+
+from .case_note_generation import CaseNotesGenerator
+from .combined_inference import CombinedInference
+from .progress_notes_inference import ProgressNotes
+from .resource_recommendation import ResourceRecommender
+from .sentiment_anaylsis import SentimentAnalysis
+
+
+@dataclass
+class PipelineResult:
+    """Outputs, errors and per-stage timings of one pipeline run."""
+
+    case_notes: dict = None
+    progress_notes: dict = None
+    sentiment: str = None
+    resource_links: list = None
+    timings: dict = field(default_factory=dict)
+    errors: dict = field(default_factory=dict)
+    wall_time: float = 0.0
+
+    def case_notes_error(self):
+        """The exception to raise when case_notes is None, whichever mode produced the result."""
+        return (self.errors.get("case_notes") or self.errors.get("combined")
+                or RuntimeError("Case notes were not generated."))
+
+
+class SessionPipeline:
+    """Runs the post-transcription LLM stages concurrently on a thread pool.
+
+    With ``combined=True`` the transcript is sent to the LLM once through
+    CombinedInference, and only the vector search for resources runs after it.
+    """
+
+    STAGES = ("case_notes", "progress_notes", "sentiment", "resource_links")
+
+    def __init__(self, transcript, template, max_workers=4, combined=False):
+        self.transcript = transcript
+        self.template = template
+        self.max_workers = max_workers
+        self.combined = combined
+
+    def run_case_notes(self):
+        return CaseNotesGenerator(self.transcript, self.template).get_notes()
+
+    def run_progress_notes(self):
+        return ProgressNotes(self.transcript).run_progress_notes()
+
+    def run_sentiment(self):
+        return SentimentAnalysis(self.transcript).run_sentiment()
+
+    def run_resource_links(self):
+        return ResourceRecommender(self.transcript).get_recommendations()
+
+    def _timed(self, stage, func):
+        """Run a single stage in a stage.<name> span and return (output, duration, error)."""
+        start = time.perf_counter()
+        try:
+            with span(f"stage.{stage}"):
+                output = func()
+            return output, time.perf_counter() - start, None
+        except Exception as e:
+            print(f"Stage {stage} failed:\n{traceback.format_exc()}")
+            return None, time.perf_counter() - start, e
+
+    def _submit(self, executor, stage):
+        # run the stage in a copy of the caller's context so its spans keep the session and parent
+        return executor.submit(contextvars.copy_context().run, self._timed, stage, getattr(self, f"run_{stage}"))
+
+    def run(self):
+        """Fan all stages out and collect them into a single PipelineResult."""
+        if self.combined:
+            return self.run_combined()
+
+        result = PipelineResult()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {stage: self._submit(executor, stage) for stage in self.STAGES}
+            for stage, future in futures.items():
+                output, duration, error = future.result()
+                setattr(result, stage, output)
+                result.timings[stage] = duration
+                if error is not None:
+                    result.errors[stage] = error
+        result.wall_time = time.perf_counter() - start
+        print(f"Pipeline finished in {result.wall_time:.2f}s, stage timings: "
+              + ", ".join(f"{k}={v:.2f}s" for k, v in result.timings.items()))
+        return result
+
+    def run_streaming(self, on_case_notes):
+        """Like run(), but stream the case notes in the calling thread.
+
+        The other stages run on the pool while on_case_notes(partial_notes) is
+        called for every partial result, so a caller such as Streamlit, which
+        may only update the page from the script thread, can render sections
+        as they are generated.
+        """
+        if self.combined:
+            result = self.run_combined()
+            if result.case_notes is not None:
+                on_case_notes(result.case_notes)
+            return result
+
+        def stream_case_notes():
+            notes = None
+            for notes in CaseNotesGenerator(self.transcript, self.template).stream_notes():
+                on_case_notes(notes)
+            return notes
+
+        result = PipelineResult()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {stage: self._submit(executor, stage)
+                       for stage in self.STAGES if stage != "case_notes"}
+            result.case_notes, duration, error = self._timed("case_notes", stream_case_notes)
+            result.timings["case_notes"] = duration
+            if error is not None:
+                result.errors["case_notes"] = error
+            for stage, future in futures.items():
+                output, duration, error = future.result()
+                setattr(result, stage, output)
+                result.timings[stage] = duration
+                if error is not None:
+                    result.errors[stage] = error
+        result.wall_time = time.perf_counter() - start
+        print(f"Streaming pipeline finished in {result.wall_time:.2f}s, stage timings: "
+              + ", ".join(f"{k}={v:.2f}s" for k, v in result.timings.items()))
+        return result
+
+    def run_combined(self):
+        """Run the single multi-task LLM call, then retrieve resources from its question."""
+        result = PipelineResult()
+        start = time.perf_counter()
+
+        output, duration, error = self._timed(
+            "combined", CombinedInference(self.transcript, self.template).run)
+        result.timings["combined"] = duration
+        if error is not None:
+            result.errors["combined"] = error
+            # the combined call also produces the case notes; callers look for their error here
+            result.errors["case_notes"] = error
+        else:
+            result.case_notes, result.progress_notes, result.sentiment, question = output
+            recommender = ResourceRecommender(self.transcript)
+            result.resource_links, duration, error = self._timed(
+                "resource_links", lambda: recommender.get_recommendations(question=question))
+            result.timings["resource_links"] = duration
+            if error is not None:
+                result.errors["resource_links"] = error
+
+        result.wall_time = time.perf_counter() - start
+        print(f"Combined pipeline finished in {result.wall_time:.2f}s, stage timings: "
+              + ", ".join(f"{k}={v:.2f}s" for k, v in result.timings.items()))
+        return result
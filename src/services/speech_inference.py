@@ -1,34 +1,70 @@
 import os
-import sys
-
-from google.cloud import speech
-from google.protobuf import wrappers_pb2
-
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-
+import uuid
+import wave
+from contextlib import contextmanager
 from datetime import datetime
 
 from dotenv import load_dotenv
-from utils import upload_to_gcs
+
+from src.clients import get_speech_client, get_storage_client
+from src.rate_limit import get_limiter
+from src.tracing import traced
+from src.utils import upload_text_to_gcs_in_background
+
+from .word_transcript import WordTranscript
 
 load_dotenv()
 
-GOOGLE_API_KEY = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
-client = speech.SpeechClient.from_service_account_file(GOOGLE_API_KEY)
+SAMPLE_RATE_HERTZ = 44100
+# streaming requests are capped at 25 KB of audio each
+STREAM_CHUNK_BYTES = 16 * 1024
+# a single streaming_recognize call is limited to about five minutes of audio,
+# so longer recordings are sent over consecutive streams
+STREAM_LIMIT_SECONDS = 290
+# streaming sends raw PCM frames, so it only takes uncompressed WAV recordings
+STREAMABLE_EXTENSIONS = (".wav",)
+ARCHIVE_BUCKET = "therapy_audio"
+
+
+def is_streamable(file_path):
+    """Whether a recording can be sent to streaming recognition; other formats use transcribe_speech."""
+    return file_path.lower().endswith(STREAMABLE_EXTENSIONS)
+
+
+def format_utterance(utterance):
+    return f"Speaker {utterance.speaker}: {utterance.text}"
+
 
 class SpeechToText:
-    def __init__(self, file_path):
+    """Transcribes a recording with speaker diarization.
+
+    ``client`` is anything exposing the ``long_running_recognize`` and
+    ``streaming_recognize`` methods of ``speech.SpeechClient``; it defaults to
+    the shared client and can be swapped for a local fake in tests.
+    """
+
+    def __init__(self, file_path, client=None, session_id=None):
         self.file_path = file_path
+        self.client = client
+        self.session_id = session_id or str(uuid.uuid4())
+        # word-level timings and confidences of the last batch transcription
+        self.word_transcript = None
 
-    def transcribe_speech(self):
-        audio = speech.RecognitionAudio(uri=self.file_path)
+    def get_client(self):
+        if self.client is None:
+            self.client = get_speech_client()
+        return self.client
+
+    def get_recognition_config(self, sample_rate_hertz=SAMPLE_RATE_HERTZ, channels=1):
+        from google.cloud import speech
+        from google.protobuf import wrappers_pb2
 
-        config = speech.RecognitionConfig(
+        return speech.RecognitionConfig(
             encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
-            sample_rate_hertz=44100,
+            sample_rate_hertz=sample_rate_hertz,
             language_code="en-US",
             model="latest_long",
-            audio_channel_count=1,
+            audio_channel_count=channels,
             enable_automatic_punctuation=True,
             enable_word_confidence=True,
             enable_word_time_offsets=True,
@@ -40,48 +76,123 @@ class SpeechToText:
             ),
         )
 
+    @traced("stt.recognize")
+    def transcribe_speech(self):
+        from google.cloud import speech
+
+        audio = speech.RecognitionAudio(uri=self.file_path)
+        config = self.get_recognition_config()
+
         # Detects speech in the audio file
-        operation = client.long_running_recognize(config=config, audio=audio)
+        client = self.get_client()
+        operation = get_limiter("speech").call(
+            lambda: client.long_running_recognize(config=config, audio=audio))
 
         print("Waiting for operation to complete...")
         response = operation.result(timeout=90)
 
         # Process the diarized result
-        speaker_texts = []
-        current_speaker = None
-        speaker_buffer = []
-
-        for result in response.results:
-            for word_info in result.alternatives[0].words:
-                speaker = word_info.speaker_tag
-                word = word_info.word
-
-                # Skip Speaker 0
-                if speaker == 0:
-                    continue
-
-                if current_speaker is None or current_speaker != speaker:
-                    if speaker_buffer:
-                        speaker_texts.append(
-                            f"Speaker {current_speaker}: {' '.join(speaker_buffer)}"
-                        )
-                    current_speaker = speaker
-                    speaker_buffer = [word]
-                else:
-                    speaker_buffer.append(word)
-
-        if speaker_buffer:
-            speaker_texts.append(
-                f"Speaker {current_speaker}: {' '.join(speaker_buffer)}"
+        self.word_transcript = WordTranscript.from_results(response.results)
+        transcript = self.word_transcript.render()
+        self.archive_transcript(transcript)
+        return transcript
+
+    def archive_transcript(self, transcript):
+        """Copy the transcript to GCS in the background under a session-scoped name."""
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        gcs_file_path = f"transcripts/{self.session_id}/transcript_{timestamp}.txt"
+        return upload_text_to_gcs_in_background(ARCHIVE_BUCKET, transcript, gcs_file_path)
+
+    @contextmanager
+    def open_wav(self):
+        """Open the recording, from GCS or the local disk, as a 16-bit PCM WAV reader."""
+        if self.file_path.startswith("gs://"):
+            bucket_name, blob_name = self.file_path[5:].split("/", 1)
+            blob = get_storage_client().bucket(bucket_name).blob(blob_name)
+            source = blob.open("rb", chunk_size=256 * 1024)
+        else:
+            source = open(self.file_path, "rb")
+
+        with source:
+            try:
+                wav = wave.open(source, "rb")
+            except (wave.Error, EOFError) as e:
+                raise ValueError(f"Streaming recognition needs a WAV file: {e}") from e
+            with wav:
+                if wav.getsampwidth() != 2:
+                    raise ValueError("Streaming recognition needs 16-bit PCM (LINEAR16) audio.")
+                yield wav
+
+    def iter_streams(self, wav, chunk_size=STREAM_CHUNK_BYTES):
+        """Split the PCM frames into whole-frame chunks, grouped into streams of at most STREAM_LIMIT_SECONDS."""
+        frame_bytes = wav.getsampwidth() * wav.getnchannels()
+        frames_per_chunk = max(1, chunk_size // frame_bytes)
+        frames_per_stream = STREAM_LIMIT_SECONDS * wav.getframerate()
+        remaining = wav.getnframes()
+
+        def one_stream(frames):
+            while frames > 0:
+                chunk = wav.readframes(min(frames_per_chunk, frames))
+                if not chunk:
+                    return
+                frames -= len(chunk) // frame_bytes
+                yield chunk
+
+        while remaining > 0:
+            frames = min(frames_per_stream, remaining)
+            yield one_stream(frames)
+            remaining -= frames
+
+    def stream_utterances(self, chunk_size=STREAM_CHUNK_BYTES):
+        """Yield diarized speaker turns as the recognizer finalizes them.
+
+        Consumers can start working on the partial transcript before the
+        whole recording has been recognized. Recordings longer than one
+        stream are sent over consecutive streaming_recognize calls, and each
+        call diarizes on its own: the same speaker number in two streams is
+        not necessarily the same person. Use transcribe_speech when speaker
+        labels must be consistent across the whole session.
+        """
+        from google.cloud import speech
+
+        client = self.get_client()
+        with self.open_wav() as wav:
+            streaming_config = speech.StreamingRecognitionConfig(
+                config=self.get_recognition_config(wav.getframerate(), wav.getnchannels()),
+                interim_results=False,
             )
-        current_date = datetime.now().strftime("%Y-%m-%d")
-
-        local_file_path = f"transcript_{current_date}.txt"
-        with open(local_file_path, "w") as file:
-            file.write("\n".join(speaker_texts))
-
-        print(f"Transcription saved to {local_file_path}.")
-        file_path = upload_to_gcs("therapy_audio", local_file_path, f"transcripts/{local_file_path}")
-
-        return file_path
-
+            for stream in self.iter_streams(wav, chunk_size):
+                requests = (speech.StreamingRecognizeRequest(audio_content=chunk)
+                            for chunk in stream)
+                # the request iterator cannot be replayed, so streams are gated but not retried
+                with get_limiter("speech").slot():
+                    responses = client.streaming_recognize(config=streaming_config, requests=requests)
+                    for response in responses:
+                        for result in response.results:
+                            if not result.is_final or not result.alternatives:
+                                continue
+                            yield from WordTranscript.from_words(result.alternatives[0].words).turns()
+
+    def stream_transcript(self, chunk_size=STREAM_CHUNK_BYTES):
+        """Yield the transcript as it grows, one formatted line per utterance."""
+        for utterance in self.stream_utterances(chunk_size):
+            yield format_utterance(utterance)
+
+    def transcribe(self, streaming=False):
+        """Transcribe with streaming recognition when asked and the format allows it, else in batch."""
+        if streaming and not is_streamable(self.file_path):
+            print(f"{os.path.basename(self.file_path)} is not WAV; using batch recognition.")
+            streaming = False
+        return self.transcribe_streaming() if streaming else self.transcribe_speech()
+
+    @traced("stt.streaming_recognize")
+    def transcribe_streaming(self):
+        """Transcribe with streaming_recognize and return the full transcript text.
+
+        Only 16-bit PCM WAV recordings are accepted; see stream_utterances
+        for how speaker labels behave on recordings longer than one stream.
+        """
+        print("Streaming audio to the recognizer...")
+        transcript = "\n".join(self.stream_transcript())
+        self.archive_transcript(transcript)
+        return transcript
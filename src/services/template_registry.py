@@ -0,0 +1,111 @@
+import glob
+import hashlib
+import json
+import os
+import threading
+
+from langchain.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import JsonOutputParser
+from pydantic import Field, create_model
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dependencies")
+
+
+class CompiledTemplate:
+    """A case-note template with everything derived from it built once.
+
+    Holds the raw JSON, the Pydantic model, its output parser and format
+    instructions, the case-notes prompt, and the section names, descriptions
+    and default contents used by ``utils.render_sections``.
+    """
+
+    def __init__(self, name, data, mtime=None):
+        from .case_note_generation import CaseNotesGenerator
+
+        self.name = name
+        self.data = data
+        self.mtime = mtime
+        self.template_type = data['template_type']
+        self.section_lst = list(data['sections'])
+        self.description_lst = [details['description'] for details in data['sections'].values()]
+        self.content_lst = [details['content'] for details in data['sections'].values()]
+
+        self.model = create_model(
+            self.template_type,
+            **{
+                section: (str, Field(description=details['description']))
+                for section, details in data['sections'].items()
+            }
+        )
+        self.parser = JsonOutputParser(pydantic_object=self.model)
+        self.format_instructions = self.parser.get_format_instructions()
+
+        generator = CaseNotesGenerator(None, data)
+        self.prompt = ChatPromptTemplate([("system", generator.get_system_prompt()),
+                                          ("human", generator.create_user_prompt())])
+
+
+class TemplateRegistry:
+    """Loads every template in TEMPLATE_DIR once and recompiles a file only when its mtime changes."""
+
+    def __init__(self, directory=TEMPLATE_DIR):
+        self.directory = directory
+        self._templates = {}
+        self._by_content = {}
+        self._lock = threading.Lock()
+        for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+            self._load(os.path.splitext(os.path.basename(path))[0])
+
+    def _path(self, name):
+        return os.path.join(self.directory, f"{name}.json")
+
+    def _load(self, name):
+        path = self._path(name)
+        mtime = os.stat(path).st_mtime
+        with open(path, "r") as f:
+            data = json.load(f)
+        # other dependency files, e.g. resource_links.json, are not templates
+        if not isinstance(data, dict) or "sections" not in data or "template_type" not in data:
+            return None
+        compiled = CompiledTemplate(name, data, mtime)
+        with self._lock:
+            self._templates[name] = compiled
+        return compiled
+
+    def names(self):
+        return list(self._templates)
+
+    def get(self, name):
+        """Return the compiled template for e.g. "soap", reloading it if the file changed."""
+        name = name.lower()
+        compiled = self._templates.get(name)
+        try:
+            mtime = os.stat(self._path(name)).st_mtime
+        except FileNotFoundError:
+            return compiled
+        if compiled is None or mtime != compiled.mtime:
+            compiled = self._load(name)
+        return compiled
+
+    def compile(self, data):
+        """Compiled form of a template dict that did not come from the registry."""
+        key = hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+        compiled = self._by_content.get(key)
+        if compiled is None:
+            compiled = CompiledTemplate(data.get('template_type', key), data)
+            with self._lock:
+                self._by_content[key] = compiled
+        return compiled
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_template_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = TemplateRegistry()
+    return _registry
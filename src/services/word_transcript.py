@@ -0,0 +1,92 @@
+from collections import namedtuple
+
+import numpy as np
+
+Turn = namedtuple("Turn", ["speaker", "start_time", "end_time", "text"])
+
+
+class WordTranscript:
+    """Column-oriented word-level transcript decoded from diarization results.
+
+    Each word is a row across parallel NumPy columns (speaker tag, start and
+    end offsets in seconds, confidence and an id into an interned word table),
+    so timing data stays available without keeping the protobuf objects
+    around. Speaker turns and text are derived from the columns on demand.
+    """
+
+    def __init__(self, speakers, start_times, end_times, confidences, word_ids, vocabulary):
+        self.speakers = speakers
+        self.start_times = start_times
+        self.end_times = end_times
+        self.confidences = confidences
+        self.word_ids = word_ids
+        self.vocabulary = vocabulary
+        self._turn_bounds = None
+
+    @classmethod
+    def from_words(cls, words, skip_speaker_zero=True):
+        """Build the columns from an iterable of ``WordInfo`` messages."""
+        vocabulary = []
+        lookup = {}
+        speakers = []
+        start_times = []
+        end_times = []
+        confidences = []
+        word_ids = []
+
+        for word_info in words:
+            # Speaker 0 marks words the diarizer could not attribute
+            if skip_speaker_zero and word_info.speaker_tag == 0:
+                continue
+            word_id = lookup.get(word_info.word)
+            if word_id is None:
+                word_id = lookup[word_info.word] = len(vocabulary)
+                vocabulary.append(word_info.word)
+            speakers.append(word_info.speaker_tag)
+            start_times.append(word_info.start_time.total_seconds())
+            end_times.append(word_info.end_time.total_seconds())
+            confidences.append(word_info.confidence)
+            word_ids.append(word_id)
+
+        return cls(
+            speakers=np.asarray(speakers, dtype=np.int16),
+            start_times=np.asarray(start_times, dtype=np.float64),
+            end_times=np.asarray(end_times, dtype=np.float64),
+            confidences=np.asarray(confidences, dtype=np.float32),
+            word_ids=np.asarray(word_ids, dtype=np.int32),
+            vocabulary=vocabulary,
+        )
+
+    @classmethod
+    def from_results(cls, results, skip_speaker_zero=True):
+        """Build the columns from the ``results`` of a recognize response."""
+        words = (word_info for result in results if result.alternatives
+                 for word_info in result.alternatives[0].words)
+        return cls.from_words(words, skip_speaker_zero)
+
+    def __len__(self):
+        return len(self.word_ids)
+
+    def turn_bounds(self):
+        """Start and end row index of every speaker turn, by run-length grouping."""
+        if self._turn_bounds is None:
+            if len(self) == 0:
+                starts = np.empty(0, dtype=np.int64)
+            else:
+                changes = np.flatnonzero(self.speakers[1:] != self.speakers[:-1]) + 1
+                starts = np.concatenate(([0], changes))
+            ends = np.append(starts[1:], len(self))
+            self._turn_bounds = (starts, ends)
+        return self._turn_bounds
+
+    def turns(self):
+        """Yield a Turn per consecutive run of words from the same speaker."""
+        starts, ends = self.turn_bounds()
+        for start, end in zip(starts, ends):
+            text = " ".join(self.vocabulary[i] for i in self.word_ids[start:end])
+            yield Turn(int(self.speakers[start]), float(self.start_times[start]),
+                       float(self.end_times[end - 1]), text)
+
+    def render(self):
+        """Render the transcript as one ``Speaker N: text`` line per turn."""
+        return "\n".join(f"Speaker {turn.speaker}: {turn.text}" for turn in self.turns())
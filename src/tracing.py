@@ -0,0 +1,271 @@
+import contextvars
+import functools
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+TRACE_PATH = os.getenv("TRACE_PATH", ".cache/traces.jsonl")
+# the trace file is rotated to .1, .2, ... once it reaches this size; older files are deleted
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", 50 * 1024 * 1024))
+TRACE_BACKUPS = int(os.getenv("TRACE_BACKUPS", 3))
+# serve Prometheus metrics on this port; unset or 0 disables the endpoint
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+# the endpoint has no authentication; bind it to another interface only behind a trusted network
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, math.inf)
+
+_session_id = contextvars.ContextVar("trace_session_id", default=None)
+_current_span = contextvars.ContextVar("trace_span", default=None)
+
+
+class Span:
+    """One timed operation; attributes hold token counts, cache hits and stage details."""
+
+    def __init__(self, name, parent_id=None, session_id=None, attributes=None):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.session_id = session_id
+        self.attributes = dict(attributes or {})
+        self.start = time.time()
+        self.duration = None
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add_tokens(self, input_tokens=0, output_tokens=0):
+        self.attributes["input_tokens"] = self.attributes.get("input_tokens", 0) + (input_tokens or 0)
+        self.attributes["output_tokens"] = self.attributes.get("output_tokens", 0) + (output_tokens or 0)
+
+    def to_dict(self):
+        return {
+            "session_id": self.session_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration": self.duration,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class JsonlExporter:
+    """Appends every finished span as one JSON line, keeping at most backups + 1 files of max_bytes."""
+
+    def __init__(self, path=TRACE_PATH, max_bytes=TRACE_MAX_BYTES, backups=TRACE_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+        self._file = None
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), default=str) + "\n"
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+            self._file.write(line)
+            if self._file.tell() >= self.max_bytes:
+                self._rotate()
+
+
+class Metrics:
+    """Aggregates finished spans into Prometheus histograms and counters."""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.durations = {}
+        self.errors = {}
+        self.tokens = {}
+        self.cache = {}
+
+    def observe(self, span):
+        with self._lock:
+            counts, total = self.durations.get(span.name, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if span.duration <= bound:
+                    counts[i] += 1
+            self.durations[span.name] = (counts, total + span.duration)
+            if span.error:
+                self.errors[span.name] = self.errors.get(span.name, 0) + 1
+            for direction in ("input", "output"):
+                tokens = span.attributes.get(f"{direction}_tokens")
+                if tokens:
+                    key = (span.name, direction)
+                    self.tokens[key] = self.tokens.get(key, 0) + tokens
+            if "cache_hit" in span.attributes:
+                key = (span.name, "hit" if span.attributes["cache_hit"] else "miss")
+                self.cache[key] = self.cache.get(key, 0) + 1
+
+    def render(self):
+        """Metrics in the Prometheus text exposition format."""
+        lines = ["# HELP casecrafter_span_duration_seconds Duration of traced operations.",
+                 "# TYPE casecrafter_span_duration_seconds histogram"]
+        with self._lock:
+            for name, (counts, total) in sorted(self.durations.items()):
+                for bound, count in zip(self.buckets, counts):
+                    le = "+Inf" if bound == math.inf else f"{bound:g}"
+                    lines.append(f'casecrafter_span_duration_seconds_bucket{{span="{name}",le="{le}"}} {count}')
+                lines.append(f'casecrafter_span_duration_seconds_sum{{span="{name}"}} {total:.6f}')
+                lines.append(f'casecrafter_span_duration_seconds_count{{span="{name}"}} {counts[-1]}')
+            lines += ["# HELP casecrafter_span_errors_total Traced operations that raised.",
+                      "# TYPE casecrafter_span_errors_total counter"]
+            lines += [f'casecrafter_span_errors_total{{span="{name}"}} {count}'
+                      for name, count in sorted(self.errors.items())]
+            lines += ["# HELP casecrafter_llm_tokens_total Model tokens reported in response metadata.",
+                      "# TYPE casecrafter_llm_tokens_total counter"]
+            lines += [f'casecrafter_llm_tokens_total{{span="{name}",direction="{direction}"}} {count}'
+                      for (name, direction), count in sorted(self.tokens.items())]
+            lines += ["# HELP casecrafter_cache_requests_total Result cache lookups by outcome.",
+                      "# TYPE casecrafter_cache_requests_total counter"]
+            lines += [f'casecrafter_cache_requests_total{{span="{name}",result="{result}"}} {count}'
+                      for (name, result), count in sorted(self.cache.items())]
+        return "\n".join(lines) + "\n"
+
+
+exporter = JsonlExporter()
+metrics = Metrics()
+
+
+def _record(span):
+    metrics.observe(span)
+    try:
+        exporter.export(span)
+    except OSError as e:
+        print(f"Could not export span {span.name}: {e}")
+
+
+class _NoopSpan:
+    def set(self, **attributes):
+        pass
+
+    def add_tokens(self, input_tokens=0, output_tokens=0):
+        pass
+
+
+@contextmanager
+def span(name, **attributes):
+    """Time the block as a child of the current span, in the current session."""
+    if not TRACING_ENABLED:
+        yield _NoopSpan()
+        return
+    parent = _current_span.get()
+    current = Span(name, parent.span_id if parent else None, _session_id.get(), attributes)
+    token = _current_span.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    except Exception as e:
+        # only the type: messages of model and parser errors can quote the transcript
+        current.error = type(e).__name__
+        raise
+    finally:
+        current.duration = time.perf_counter() - start
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # a generator was resumed in another context
+            pass
+        _record(current)
+
+
+def traced(name):
+    """Decorator form of span()."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def trace_session(session_id):
+    """Tag every span started in the block with session_id, the correlation key."""
+    token = _session_id.set(session_id)
+    try:
+        yield
+    finally:
+        _session_id.reset(token)
+
+
+def current_span():
+    return _current_span.get() or _NoopSpan()
+
+
+def annotate(**attributes):
+    current_span().set(**attributes)
+
+
+def add_tokens(input_tokens=0, output_tokens=0):
+    current_span().add_tokens(input_tokens, output_tokens)
+
+
+def usage_callback():
+    """LangChain callback handler adding each LLM response's token usage to the current span."""
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class UsageCallback(BaseCallbackHandler):
+        def on_llm_end(self, response, **kwargs):
+            for generations in response.generations:
+                for generation in generations:
+                    usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                    if usage:
+                        add_tokens(usage.get("input_tokens", 0), usage.get("output_tokens", 0))
+                        continue
+                    usage = (generation.generation_info or {}).get("usage_metadata") or {}
+                    add_tokens(usage.get("prompt_token_count", 0), usage.get("candidates_token_count", 0))
+
+    return UsageCallback()
+
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    """Serve metrics.render() at /metrics on a background thread; returns the server or None."""
+    if not port:
+        return None
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"Serving metrics on {host}:{port}/metrics")
+    return server
@@ -1,17 +1,23 @@
+import contextvars
 import json
+import os
 import datetime
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
-from google.cloud import storage
 from dotenv import load_dotenv
 
 load_dotenv()
-from langchain_google_vertexai import ChatVertexAI, HarmBlockThreshold, HarmCategory
-import vertexai
-vertexai.init(project="lithe-sandbox-444313-n8", location="asia-southeast1")
+from src import clients
+from src.tracing import traced
 
 from urllib.parse import urlparse
 
+# uploads that are not on the critical path, e.g. transcript archival
+_background_uploads = ThreadPoolExecutor(max_workers=2, thread_name_prefix="gcs-upload")
+# resumable upload chunk size, must be a multiple of 256 KB
+UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+
 
 # def read_transcript(file_path):
 #     with open(file_path, 'r', encoding='utf-8') as file:
@@ -21,7 +27,7 @@ def read_text_file_from_gcs(gcs_uri):
     path_parts = gcs_uri[5:].split("/", 1) 
     bucket_name = path_parts[0]
     blob_name = path_parts[1]
-    client = storage.Client()
+    client = clients.get_storage_client()
     bucket = client.bucket(bucket_name)
     blob = bucket.blob(blob_name)
     content = blob.download_as_text()
@@ -32,27 +38,34 @@ def load_template(template_name):
         return json.load(f)
     
 def load_model():
-    model = ChatVertexAI(
-        model_name="gemini-1.5-pro",
-        convert_system_message_to_human=True,
-        safety_settings={
-            HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_LOW_AND_ABOVE
-        },
-    )
-    return model
+    return clients.get_chat_model()
 
-def load_css(file_name):
+@st.cache_data
+def read_css(file_name):
     with open(file_name) as f:
-        st.markdown(f'<style>{f.read()}</style>', unsafe_allow_html=True)
+        return f.read()
 
-def save_audio_file(audio_bytes, file_extension):
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    file_name = f"audio_{timestamp}.{file_extension}"
+def load_css(file_name):
+    st.markdown(f'<style>{read_css(file_name)}</style>', unsafe_allow_html=True)
 
-    with open(file_name, "wb") as f:
-        f.write(audio_bytes)
+def upload_audio_to_gcs(bucket_name, audio_file, session_id):
+    """Stream an uploaded recording to GCS once per session and return its URI.
+
+    The object handle is kept in the session state, so reruns and repeated
+    Generate clicks on the same file reuse the existing upload.
+    """
+    upload_key = (audio_file.name, audio_file.size)
+    previous = st.session_state.get('audio_upload')
+    if previous and previous['key'] == upload_key:
+        return previous['uri']
+
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    extension = os.path.splitext(audio_file.name)[1].lower() or ".mp3"
+    gcs_file_path = f"audio_files/{session_id}/audio_{timestamp}{extension}"
+    uri = upload_stream_to_gcs(bucket_name, audio_file, gcs_file_path, content_type=audio_file.type)
 
-    return file_name
+    st.session_state['audio_upload'] = {'key': upload_key, 'uri': uri}
+    return uri
 
 def setup_session():
     client_name = "John Doe"
@@ -96,12 +109,45 @@ def get_selected_keys_string(section_keys):
     selected_keys_string = ", ".join([key for key, value in selected_values.items() if value])
     return selected_keys_string
 
+@traced("gcs.upload")
 def upload_to_gcs(bucket_name, local_file_path, gcs_file_path):
-    storage_client = storage.Client()
+    storage_client = clients.get_storage_client()
     bucket = storage_client.bucket(bucket_name)
     blob = bucket.blob(gcs_file_path)
 
     blob.upload_from_filename(local_file_path)
 
     print(f"File {local_file_path} uploaded to gs://{bucket_name}/{gcs_file_path}.")
-    return f"gs://{bucket_name}/{gcs_file_path}"
\ No newline at end of file
+    return f"gs://{bucket_name}/{gcs_file_path}"
+
+@traced("gcs.upload")
+def upload_stream_to_gcs(bucket_name, file_obj, gcs_file_path, content_type=None,
+                         chunk_size=UPLOAD_CHUNK_BYTES):
+    """Upload a file-like object with a chunked resumable upload in constant memory."""
+    storage_client = clients.get_storage_client()
+    blob = storage_client.bucket(bucket_name).blob(gcs_file_path, chunk_size=chunk_size)
+    file_obj.seek(0)
+    blob.upload_from_file(file_obj, content_type=content_type)
+
+    print(f"Stream uploaded to gs://{bucket_name}/{gcs_file_path}.")
+    return f"gs://{bucket_name}/{gcs_file_path}"
+
+@traced("gcs.upload")
+def upload_text_to_gcs(bucket_name, text, gcs_file_path):
+    storage_client = clients.get_storage_client()
+    blob = storage_client.bucket(bucket_name).blob(gcs_file_path)
+    blob.upload_from_string(text, content_type="text/plain")
+
+    print(f"Text uploaded to gs://{bucket_name}/{gcs_file_path}.")
+    return f"gs://{bucket_name}/{gcs_file_path}"
+
+def upload_text_to_gcs_in_background(bucket_name, text, gcs_file_path):
+    """Upload text without blocking the caller; failures are printed, not raised."""
+    def upload():
+        try:
+            return upload_text_to_gcs(bucket_name, text, gcs_file_path)
+        except Exception as e:
+            print(f"Background upload to gs://{bucket_name}/{gcs_file_path} failed: {e}")
+
+    # keep the caller's session on the upload span
+    return _background_uploads.submit(contextvars.copy_context().run, upload)